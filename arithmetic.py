@@ -2,75 +2,146 @@
 # -*- coding: utf-8 -*-
 
 # PURPOSE:    This module contains all arithmetic functions used in the program.
+# Each function is a NumPy ufunc (or ufunc reduction) applied to whole arrays, and equally accepts
+# single numbers. An out array can be passed to write the result into an existing buffer instead of
+# allocating a new one, and dtype sets the type the calculation is carried out in.
+# RMSEAccumulator calculates the normalised RMSE in one pass over chunks of values.
 
 # Library imports
-from math import sqrt
-from numpy import array
+import numpy as np
 
 
-def calc_diff(data_1, data_2):
+def calc_diff(data_1, data_2, out=None, dtype=None):
     """
-    Subtracts two numbers
+    Subtracts two numbers or arrays, element-wise
     """
-    return data_1 - data_2
+    return np.subtract(data_1, data_2, out=out, dtype=dtype)
 
 
-def calc_sum(data_1, data_2):
+def calc_sum(data_1, data_2, out=None, dtype=None):
     """
-    Adds two numbers
+    Adds two numbers or arrays, element-wise
     """
-    return data_1 + data_2
+    return np.add(data_1, data_2, out=out, dtype=dtype)
 
 
-def square_number(data_1):
+def square_number(data_1, out=None, dtype=None):
     """
-    Multiples a number by itself (i.e. squared)
+    Multiples a number by itself (i.e. squared), element-wise
     """
-    return data_1 ** 2
+    return np.square(data_1, out=out, dtype=dtype)
 
 
-def sum_array(data_1):
+def calc_abs(data_1, out=None, dtype=None):
     """
-    Sums a list or array
+    Calculates the absolute value, element-wise
     """
-    return sum(data_1)
+    return np.absolute(data_1, out=out, dtype=dtype)
 
 
-def minus_array(data_1, data_2):
+def sum_array(data_1, axis=0, out=None, dtype=None):
     """
-    Subtracts elements in array_1 with corresponding elements in array_2
+    Sums a list or array along axis (default is the first axis, None sums all elements)
     """
-    return array(data_1) - array(data_2)
+    return np.add.reduce(data_1, axis=axis, out=out, dtype=dtype)
 
 
-def calc_square_root(data_1):
+def max_array(data_1, axis=None, out=None):
     """
-    Calculates the square root
+    Finds the largest value of an array along axis (default is all elements), ignoring missing values.
+    An empty array (or slice) gives a missing value
     """
-    return sqrt(data_1)
+    return np.fmax.reduce(data_1, axis=axis, out=out, initial=np.nan)
 
 
-def calc_prod(data_1, data_2):
+def minus_array(data_1, data_2, out=None, dtype=None):
     """
-    Multiplies two numbers
+    Subtracts elements in array_1 with corresponding elements in array_2, without copying the inputs
     """
-    return data_1 * data_2
+    return np.subtract(data_1, data_2, out=out, dtype=dtype)
 
 
-def norm_root_mean_squared_error(y1, y2):
+def calc_square_root(data_1, out=None, dtype=None):
+    """
+    Calculates the square root, element-wise. Raises ValueError for a negative single number
+    """
+    if np.ndim(data_1) == 0 and data_1 < 0:
+        raise ValueError('Invalid data: square root of negative number {}'.format(data_1))
+    return np.sqrt(data_1, out=out, dtype=dtype)
+
+
+def calc_prod(data_1, data_2, out=None, dtype=None):
+    """
+    Multiplies two numbers or arrays, element-wise
+    """
+    return np.multiply(data_1, data_2, out=out, dtype=dtype)
+
+
+class RMSEAccumulator:
+    """
+    Accumulates the normalised root mean squared error (RMSE) over chunks of values in a single pass,
+    keeping only the running sum of squared errors, count, and minimum and maximum of the original values.
+    Input:
+        None - chunks are passed to update.
+    Output:
+        norm_rmse (float) - from norm_rmse, as norm_root_mean_squared_error over all chunks.
+    """
+    # Initiates new constructor
+    def __init__(self):
+        self.sum_squares = 0.0
+        self.count = 0
+        self.y_min = np.inf
+        self.y_max = -np.inf
+
+    def update(self, y1, y2):
+        """
+        Adds a chunk of values.
+        Input:
+            y1 (array) - original y function values.
+            y2 (array) - modelled y function values, predicted from model.
+        """
+        array_diff = minus_array(y1, y2, dtype=np.float64)
+        if array_diff.size == 0:
+            return
+        diff_squared = square_number(array_diff, out=array_diff)
+        self.sum_squares += sum_array(diff_squared, axis=None)
+        self.count += diff_squared.size
+        self.y_min = np.minimum(self.y_min, np.min(y1))
+        self.y_max = np.maximum(self.y_max, np.max(y1))
+
+    def norm_rmse(self):
+        """
+        Returns the normalised RMSE of all chunks added so far.
+        """
+        if self.count == 0:
+            return np.nan
+        rmse = calc_square_root(self.sum_squares / self.count)
+        return rmse / (self.y_max - self.y_min)
+
+
+def norm_root_mean_squared_error(y1, y2, axis=None, chunk_size=65536):
     """
     Calculates the normalised root mean squared error (RMSE) of the model.
     Normalised figure reflects the RMSE within the range of the y-axis.
     Input:
         y1 (array) - original y function values.
         y2 (array) - modelled y function values, predicted from model.
+        axis (int) - default None uses all values in a single pass over chunks of chunk_size values (see
+        RMSEAccumulator), else calculates one figure per slice along axis.
     Output:
-        norm_rmse (float) - root mean squared error, normalised.
-    """
-    # rmse = mean_squared_error(y1, y2, squared=False)
-    array_diff = minus_array(y1, y2)
-    diff_squared = square_number(array_diff)
-    mse = sum_array(diff_squared) / len(diff_squared)
+        norm_rmse (float or array) - root mean squared error, normalised.
+    """
+    if axis is None:
+        y1 = np.ravel(y1)
+        # A single modelled value is compared to every chunk as it is
+        y2 = np.ravel(y2) if np.ndim(y2) else y2
+        accumulator = RMSEAccumulator()
+        for start in range(0, len(y1), chunk_size):
+            accumulator.update(y1[start:start + chunk_size], y2[start:start + chunk_size] if np.ndim(y2) else y2)
+        return accumulator.norm_rmse()
+    array_diff = minus_array(y1, y2, dtype=np.float64)
+    diff_squared = square_number(array_diff, out=array_diff)
+    mse = sum_array(diff_squared, axis=axis) / diff_squared.shape[axis]
     rmse = calc_square_root(mse)
-    norm_rmse = rmse/(max(y1)-min(y1))
+    norm_rmse = rmse / np.ptp(y1, axis=axis)
     return norm_rmse
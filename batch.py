@@ -0,0 +1,248 @@
+# batch.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module runs the mapping pipeline for many input folders in one program run.
+# (1) Expands the folders (or glob patterns) given and groups them by the content of their ideal file.
+# (2) Parses each distinct ideal file once and shares it with the worker processes through shared memory.
+# (3) Maps each folder on a worker pool with a configurable number of workers, writing the mapped test
+# data, summary results and a dashboard of all graphs per folder.
+# (4) Writes a combined summary of all folders at the end.
+# Run e.g. python batch.py --dirs data/run_* --workers 4 --out batch_output
+
+
+# Library imports
+import argparse
+import logging
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+# Imports own modules
+import input_args_files
+import etl_table
+from etl_sql import file_content_hash
+from etl_table import df_from_columns
+from parse_cache import ParseCache
+from pipeline import PipelineContext
+from test import TestFunctionReturner
+from graphing import IdealPlotter
+from summary import SummaryReporter
+from unmapped import UnmappedClusters
+from dashboard import Dashboard
+from shared_frames import SharedFrame
+from shared_frames import attach_frame
+from instrument import stage
+
+# Ideal dataframes by content hash of the ideal file, attached by each worker process
+_worker_ideals = dict()
+
+
+def _init_batch_worker(ideal_specs):
+    """
+    Attaches the shared ideal dataframes, once per worker process.
+    """
+    _worker_ideals.clear()
+    _worker_ideals.update({key: attach_frame(spec) for key, spec in ideal_specs.items()})
+
+
+def _output_folders(folders, out_dir):
+    """
+    Names an output folder for each input folder after its base name, numbering repeated names.
+    """
+    names, seen = [], dict()
+    for folder in folders:
+        name = os.path.basename(os.path.normpath(folder))
+        seen[name] = seen.get(name, 0) + 1
+        names.append(os.path.join(out_dir, name if seen[name] == 1 else name + '_' + str(seen[name])))
+    return names
+
+
+def _run_folder(task):
+    """
+    Maps one folder's test data, writing its outputs.
+    Input:
+        task (tuple) - folder, its file names (see input_args_files.get_file_names), the ideal file's
+        content hash, the output folder, the parse cache folder (or None) and the y dtype.
+    Output:
+        result (dict) - the folder's row of the combined summary.
+    """
+    folder, files_folder, ideal_key, out_folder, cache_dir, y_dtype = task
+    start = time.perf_counter()
+    result = {'folder': folder, 'output': out_folder, 'status': 'ok', 'error': None}
+    try:
+        with stage('batch_folder'):
+            parse_cache = ParseCache(cache_dir) if cache_dir else None
+            train = df_from_columns(etl_table.TableConverter(files_folder['train'], parse_cache)
+                                    .table_to_columns(y_dtype=y_dtype))
+            test = df_from_columns(etl_table.TableConverter(files_folder['test'], parse_cache)
+                                   .table_to_columns(y_dtype=y_dtype))
+            ideal = _worker_ideals[ideal_key][1]
+
+            # Maps the test data once, shared by all outputs of the folder
+            context = PipelineContext(train_df=train, ideal_df=ideal, test_df=test)
+            test_fns = context.returner(TestFunctionReturner, 2)
+            mapped = test_fns.mapped_fns_df()
+            os.makedirs(out_folder, exist_ok=True)
+            mapped.to_csv(os.path.join(out_folder, 'mapped.csv'))
+            summary = SummaryReporter(2, 10, 1, context=context).summary()
+            summary.to_csv(os.path.join(out_folder, 'summary.csv'))
+
+            # Saves all graphs of the folder as one dashboard
+            dashboard = Dashboard(os.path.basename(out_folder))
+            context.returner(IdealPlotter, 2).mapped_plotted_fns(dashboard=dashboard)
+            context.returner(IdealPlotter, 2).mapped_plotted_fns(True, dashboard=dashboard)
+            SummaryReporter(2, 10, 1, context=context).summary_graphs(dashboard)
+            unmapped_analysis = context.returner(UnmappedClusters, 6)
+            unmapped_analysis.original_cluster_display(dashboard)
+            unmapped_analysis.polynomial_display(dashboard)
+            dashboard.save(os.path.join(out_folder, 'dashboard.html'))
+
+            result.update({'ideal_functions': ' '.join(test_fns.ideal_function().values()),
+                           'test_points': test.shape[0],
+                           'mapped_points': mapped.shape[0],
+                           'unmapped_points': test_fns.unmapped_fns_set().shape[0]})
+    except Exception as exc:
+        logging.exception(('Batch folder failed:', folder))
+        result.update({'status': 'failed', 'error': repr(exc)})
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def _parse_ideals(file_sets, cache_dir, y_dtype):
+    """
+    Parses each distinct ideal file once, identified by its content hash. Files are first told apart by
+    path, size and modification time, so an ideal file shared by many folders is only hashed once.
+    Input:
+        file_sets (list) - file names of each folder, see input_args_files.get_file_names.
+        cache_dir (str) - parse cache folder, or None.
+        y_dtype (dtype) - dtype of the y columns.
+    Output:
+        keys (list) - ideal content hash of each folder (the file path if the file could not be read).
+        ideals (dict) - ideal dataframe by content hash.
+        errors (dict) - error by key, for ideal files which could not be read or parsed.
+    """
+    parse_cache = ParseCache(cache_dir) if cache_dir else None
+    keys, ideals, errors, hashes = [], dict(), dict(), dict()
+    for files_folder in file_sets:
+        ideal_file = files_folder['ideal']
+        # Symbolic links to one shared ideal file resolve to the same path
+        file_path = os.path.realpath(next(iter(ideal_file.values())))
+        try:
+            file_stat = os.stat(file_path)
+            file_id = (file_path, file_stat.st_size, file_stat.st_mtime_ns)
+            if file_id not in hashes:
+                hashes[file_id] = file_content_hash(file_path)
+            key = hashes[file_id]
+        except OSError as exc:
+            key = file_path
+            errors[key] = repr(exc)
+        if key not in ideals and key not in errors:
+            try:
+                ideals[key] = df_from_columns(etl_table.TableConverter(ideal_file, parse_cache)
+                                              .table_to_columns(y_dtype=y_dtype))
+            except Exception as exc:
+                # Reported for every folder using the file, the other folders still run
+                logging.exception(('Batch ideal file failed:', file_path))
+                errors[key] = repr(exc)
+        keys.append(key)
+    return keys, ideals, errors
+
+
+def run_batch(folders, out_dir, workers=1, cache_dir='parse_cache', y_dtype=np.float64):
+    """
+    Runs the pipeline for each folder on a pool of worker processes, then writes the combined summary.
+    Folders without one each of train, test and ideal csv files are reported as failed.
+    Input:
+        folders (list) - input folders.
+        out_dir (str) - folder the per folder outputs and batch_summary.csv are written to.
+        workers (int) - default is 1 (run in this process), else the number of worker processes.
+        cache_dir (str) - parse cache folder, None disables the parse cache.
+        y_dtype (dtype) - dtype of the y columns, default is float64.
+    Output:
+        summary (dataframe) - one row per folder, as saved to batch_summary.csv.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    out_folders = _output_folders(folders, out_dir)
+    results, tasks, file_sets = [], [], []
+    for folder, out_folder in zip(folders, out_folders):
+        files_folder = input_args_files.get_file_names(folder)
+        if all(name in files_folder for name in ('train', 'test', 'ideal')):
+            file_sets.append(files_folder)
+            tasks.append([folder, files_folder, None, out_folder, cache_dir, y_dtype])
+        else:
+            results.append({'folder': folder, 'output': out_folder, 'status': 'failed', 'seconds': 0.0,
+                            'error': 'train, test and ideal csv files required'})
+
+    with stage('batch_ideal_parse', rows=len(tasks)):
+        keys, ideals, errors = _parse_ideals(file_sets, cache_dir, y_dtype)
+    logging.info(('Batch folders:', len(tasks), 'distinct ideal files:', len(ideals)))
+    for task, key in zip(tasks, keys):
+        task[2] = key
+    # Folders whose ideal file could not be parsed are reported as failed
+    results.extend({'folder': task[0], 'output': task[3], 'status': 'failed', 'seconds': 0.0,
+                    'error': errors[task[2]]} for task in tasks if task[2] in errors)
+    tasks = [task for task in tasks if task[2] not in errors]
+
+    if workers > 1 and len(tasks) > 1:
+        # Shares each ideal dataframe with the workers, rather than pickling it per folder. Each parsed
+        # dataframe is released once copied, so only the shared copy is held
+        shared = dict()
+        for key in list(ideals):
+            shared[key] = SharedFrame(ideals.pop(key))
+        try:
+            with Pool(min(workers, len(tasks)), initializer=_init_batch_worker,
+                      initargs=({key: frame.spec for key, frame in shared.items()},)) as pool:
+                results.extend(pool.imap_unordered(_run_folder, [tuple(task) for task in tasks]))
+        finally:
+            for frame in shared.values():
+                frame.close()
+    else:
+        # Runs in this process, releasing the ideal dataframes once all folders have run
+        _worker_ideals.update({key: (None, df) for key, df in ideals.items()})
+        del ideals
+        try:
+            results.extend(_run_folder(tuple(task)) for task in tasks)
+        finally:
+            _worker_ideals.clear()
+
+    # Writes the combined summary, in the order the folders were given
+    order = {folder: num for num, folder in enumerate(folders)}
+    summary = pd.DataFrame(sorted(results, key=lambda result: order[result['folder']]),
+                           columns=['folder', 'status', 'ideal_functions', 'test_points', 'mapped_points',
+                                    'unmapped_points', 'seconds', 'output', 'error'])
+    summary.to_csv(os.path.join(out_dir, 'batch_summary.csv'), index=False)
+    return summary
+
+
+def get_batch_args():
+    """
+    Retrieves the batch mode's command line arguments.
+    """
+    parser = argparse.ArgumentParser(description='Map the train, test and ideal functions of many folders')
+    parser.add_argument('--dirs', type=str, nargs='+', required=True,
+                        help='Folders with train, test and ideal functions, glob patterns are expanded')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of folders run at once')
+    parser.add_argument('--out', type=str, default='batch_output', help='Folder to write the outputs to')
+    parser.add_argument('--float32', action='store_true', help='Hold y data as float32 to halve its memory')
+    parser.add_argument('--parse-cache', type=str, default='parse_cache',
+                        help='Folder caching the parsed csv files, memory-mapped on later runs while unchanged')
+    parser.add_argument('--no-parse-cache', action='store_true', help='Always parse the csv files')
+    return parser.parse_args()
+
+
+def main():
+    args = get_batch_args()
+    os.makedirs(args.out, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(args.out, 'logfile.log'), level=logging.INFO)
+    folders = input_args_files.expand_folders(args.dirs)
+    summary = run_batch(folders, args.out, args.workers, None if args.no_parse_cache else args.parse_cache,
+                        np.float32 if args.float32 else np.float64)
+    print(summary[['folder', 'status', 'mapped_points', 'seconds']].to_string(index=False))
+
+
+# Call to main function to run the batch
+if __name__ == "__main__":
+    main()
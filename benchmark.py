@@ -0,0 +1,213 @@
+# benchmark.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module benchmarks the whole pipeline on synthetic data.
+# (1) Generates train, ideal and test csv files of a chosen size.
+# (2) Times each stage of the pipeline separately, from csv parsing to graph output.
+# (3) Appends one JSON line per dataset size to the results file, so that scaling curves can be tracked
+# and regressions caught between releases.
+# Run e.g. python benchmark.py --x-points 400 4000 --ideal-funcs 50 500 --output benchmark_results.jsonl
+
+
+# Library imports
+import argparse
+import itertools
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import Session
+
+# Imports own modules
+import etl_table
+import etl_sql
+from train import TrainFunctionReturner
+from test import TestFunctionReturner
+from graphing import IdealPlotter
+from graphing import create_graph_folder
+from summary import SummaryReporter
+from unmapped import UnmappedClusters
+
+
+def generate_dataset(folder, x_points=400, ideal_funcs=50, train_funcs=4, test_points=100, seed=0):
+    """
+    Writes synthetic train.csv, ideal.csv and test.csv files to folder.
+    Ideal functions are random polynomial and sine curves. Train functions are randomly chosen ideal
+    functions with noise added. Roughly 60% of test points lie close to a train function's ideal
+    function, the rest are scattered so that unmapped points and clusters exist.
+    Input:
+        folder (str) - folder to write the csv files to.
+        x_points (int) - number of x values in train and ideal.
+        ideal_funcs (int) - number of ideal functions.
+        train_funcs (int) - number of train functions, at most ideal_funcs.
+        test_points (int) - number of test points.
+        seed (int) - random seed.
+    Output:
+        files_folder (dict) - maps train, test and ideal to {name: file path}, as input_args_files.get_file_names.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-20, 20, x_points)
+
+    coefs = rng.normal(size=(3, ideal_funcs))
+    freqs = np.arange(1, ideal_funcs + 1)
+    ideal = (coefs[0] * x[:, np.newaxis] ** 2 / 10 + coefs[1] * x[:, np.newaxis] + coefs[2] * 5
+             + np.sin(x[:, np.newaxis] * freqs / 7) * freqs / 10)
+
+    chosen = rng.choice(ideal_funcs, size=train_funcs, replace=False)
+    train = ideal[:, chosen] + rng.normal(scale=0.3, size=(x_points, train_funcs))
+
+    test_pos = rng.integers(0, x_points, size=test_points)
+    near = ideal[test_pos, chosen[rng.integers(0, train_funcs, size=test_points)]]
+    near = near + rng.normal(scale=0.3, size=test_points)
+    scattered = rng.normal(scale=ideal.std() * 2, size=test_points)
+    test_y = np.where(rng.random(test_points) < 0.6, near, scattered)
+
+    files_folder = {}
+    tables = {'train': (x[:, np.newaxis], train), 'ideal': (x[:, np.newaxis], ideal),
+              'test': (x[test_pos, np.newaxis], test_y[:, np.newaxis])}
+    for file_name, (x_values, y_values) in tables.items():
+        if file_name == 'test':
+            header = 'x,y'
+        else:
+            header = ','.join(['x'] + ['y' + str(num) for num in range(1, y_values.shape[1] + 1)])
+        file_path = os.path.join(folder, file_name + '.csv')
+        # Full precision keeps test x values identical to the ideal x values after parsing
+        np.savetxt(file_path, np.hstack([x_values, y_values]), delimiter=',', header=header, comments='',
+                   fmt='%.17g')
+        files_folder[file_name] = {file_name: file_path}
+    return files_folder
+
+
+class StageTimer:
+    """
+    Records the wall time of each pipeline stage.
+    Output is the list of stage records, each with stage name, seconds and rows processed.
+    """
+    # Initiates new constructor
+    def __init__(self):
+        self.records = []
+
+    def run(self, stage, func, rows=None):
+        """
+        Runs func and records its wall time.
+        Input:
+            stage (str) - name of the stage.
+            func (function) - called without arguments.
+            rows (int) - optional number of rows processed by the stage.
+        Output:
+            result of func.
+        """
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        self.records.append({'stage': stage, 'seconds': seconds, 'rows': rows})
+        return result
+
+
+def run_benchmark(folder, x_points, ideal_funcs, train_funcs, test_points, sweep_stop=10):
+    """
+    Generates a dataset in folder and times each stage of the pipeline on it.
+    Graphs are written to folder.
+    Input:
+        folder (str) - working folder for the csv files, database and graphs.
+        x_points, ideal_funcs, train_funcs, test_points (int) - dataset size, see generate_dataset.
+        sweep_stop (int) - last square root of the SummaryReporter sweep, starting at 2.
+    Output:
+        records (list) - stage records from StageTimer.
+    """
+    timer = StageTimer()
+    files_folder = generate_dataset(folder, x_points, ideal_funcs, train_funcs, test_points)
+    table_names = ['Test', 'Train', 'Ideal']
+    converters = [etl_table.TableConverter(files_folder[name.lower()]) for name in table_names]
+
+    # Loading stages
+    dicts = timer.run('csv_parse', lambda: [converter.table_to_dict() for converter in converters],
+                      rows=x_points * 2 + test_points)
+    schemas = timer.run('schema_create', lambda: [etl_sql.SQLTableBuilder(d).schema_create() for d in dicts],
+                        rows=x_points * 2 + test_points)
+
+    base = declarative_base()
+    engine = create_engine("sqlite://")
+    classes = [type(class_dict['clsname'], (base,), class_dict) for class_dict, _ in schemas]
+    base.metadata.create_all(engine)
+
+    def orm_insert():
+        with Session(engine) as sess:
+            for table_class, (_, data) in zip(classes, schemas):
+                sess.add_all(table_class(**rec) for rec in data)
+            sess.commit()
+    timer.run('orm_insert', orm_insert, rows=x_points * 2 + test_points)
+
+    test, train, ideal = timer.run('df_create', lambda: [etl_sql.SQLTableReader(engine, name).read_frame()
+                                                         for name in table_names], rows=x_points * 2 + test_points)
+    engine.dispose()
+
+    # Analysis stages, each object starting from its own empty result cache unless warmed on purpose
+    timer.run('ideal_function', TrainFunctionReturner(train, ideal).ideal_function, rows=x_points)
+
+    test_fns = TestFunctionReturner(train, ideal, test, 2)
+    test_fns.mapped_fns()
+    timer.run('_mapped_fns', test_fns._mapped_fns, rows=test_points)
+
+    sweep = SummaryReporter(2, sweep_stop, 1, train, ideal, test)
+    timer.run('summary', sweep.summary, rows=test_points)
+
+    unmapped_analysis = UnmappedClusters(train_df=train, ideal_df=ideal, test_df=test)
+    unmapped_set = unmapped_analysis.unmapped_fns_set()
+    timer.run('clustering', unmapped_analysis._clustered_df, rows=unmapped_set.shape[0])
+
+    # Graph output stage, with the mapping already cached
+    create_graph_folder()
+    create_graph_folder('additional_graphs')
+    plotter = IdealPlotter(train_df=train, ideal_df=ideal, sq_root_number=2, test_df=test)
+    plotter.get_plot_data()
+    timer.run('graph_output', lambda: plotter.mapped_plotted_fns(True), rows=x_points)
+    return timer.records
+
+
+def get_benchmark_args():
+    """
+    Retrieves the benchmark's command line arguments. Each size argument accepts several values, and
+    every combination is run.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark each pipeline stage on synthetic data')
+    parser.add_argument('--x-points', type=int, nargs='+', default=[400], help='Number of x values')
+    parser.add_argument('--ideal-funcs', type=int, nargs='+', default=[50], help='Number of ideal functions')
+    parser.add_argument('--train-funcs', type=int, nargs='+', default=[4], help='Number of train functions')
+    parser.add_argument('--test-points', type=int, nargs='+', default=[100], help='Number of test points')
+    parser.add_argument('--output', type=str, default='benchmark_results.jsonl',
+                        help='JSON lines file the results are appended to')
+    return parser.parse_args()
+
+
+def main():
+    args = get_benchmark_args()
+    sizes = itertools.product(args.x_points, args.ideal_funcs, args.train_funcs, args.test_points)
+    for x_points, ideal_funcs, train_funcs, test_points in sizes:
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            try:
+                records = run_benchmark(folder, x_points, ideal_funcs, train_funcs, test_points)
+            finally:
+                os.chdir(cwd)
+        result = {'timestamp': time.time(),
+                  'python': platform.python_version(),
+                  'params': {'x_points': x_points, 'ideal_funcs': ideal_funcs,
+                             'train_funcs': train_funcs, 'test_points': test_points},
+                  'stages': records}
+        with open(args.output, 'a') as results_file:
+            results_file.write(json.dumps(result) + '\n')
+        print(result['params'])
+        for record in records:
+            print(f'{record["stage"]:<16}{record["seconds"]:>10.4f}s')
+
+
+# Call to main function to run the benchmark
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# dashboard.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module collects the program's Bokeh graphs into a single tabbed HTML document.
+# BokehJS resources are inlined once for the whole document, and figures plotting the same data (such as
+# the mapped and unmapped graphs of an ideal function) share their ColumnDataSources, so the data is
+# only embedded once.
+
+
+# Library imports
+from bokeh.models import ColumnDataSource
+from bokeh.models import Tabs
+from bokeh.io import save
+from bokeh.resources import INLINE
+
+try:
+    from bokeh.models import TabPanel
+except ImportError:  # Bokeh < 3.0
+    from bokeh.models import Panel as TabPanel
+
+
+class Dashboard:
+    """
+    Collects figures as tabs of one document, then saves the document once.
+    Input:
+        title (str) - title of the HTML document.
+    Output:
+        Saved tabbed Bokeh document, see save.
+    """
+    # Initiates new constructor
+    def __init__(self, title='Ideal function mapping'):
+        self.title = title
+        self.panels = []
+        self._sources = dict()
+
+    def source(self, key, data):
+        """
+        Returns the ColumnDataSource shared under key, creating it from data on first use.
+        Input:
+            key (tuple) - identifies the data, e.g. (function name, 'y_ideal').
+            data (dict) - column data, only used if the source does not exist yet.
+        Output:
+            ColumnDataSource
+        """
+        if key not in self._sources:
+            self._sources[key] = ColumnDataSource(data=data)
+        return self._sources[key]
+
+    def add(self, title, fig):
+        """
+        Adds a figure as a new tab.
+        Input:
+            title (str) - tab title.
+            fig (figure) - Bokeh figure.
+        """
+        self.panels.append(TabPanel(child=fig, title=title))
+
+    def save(self, filename):
+        """
+        Saves all tabs as one HTML document, with the Bokeh resources inlined once.
+        Input:
+            filename (str) - path of the HTML file.
+        """
+        save(Tabs(tabs=self.panels), filename=filename, resources=INLINE, title=self.title)
+
+
+def data_source(dashboard, key, data):
+    """
+    Returns the dashboard's shared ColumnDataSource for key, or a new ColumnDataSource without a dashboard.
+    """
+    if dashboard is None:
+        return ColumnDataSource(data=data)
+    return dashboard.source(key, data)
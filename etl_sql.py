@@ -6,7 +6,40 @@ from sqlalchemy import Integer
 from sqlalchemy import Column
 from sqlalchemy import String
 from sqlalchemy import Float
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+from sqlalchemy import inspect
 from collections import OrderedDict
+from itertools import islice
+import hashlib
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def sorted_column_name(key):
+    """
+    Adds a leading zero to y column numbers in the range 1-9, e.g. y1_train_func -> y01_train_func,
+    so that the columns sort correctly. Other column names are returned unchanged.
+    Input:
+        key (str) - column name.
+    Output:
+        k (str) - sortable column name.
+    """
+    # Searches for correct y columns meeting criteria
+    if 'y' in key and 'delta' not in key:
+        num = key[1:].split('_')[0]
+        re1, re2 = key[1:].split('_')[1], key[1:].split('_')[2]
+        num = str(num)
+        if len(num) == 1:
+            num = '0' + num
+        y_num = 'y' + num
+        k = '_'.join((y_num, re1, re2))
+    else:
+        k = key
+    return k
 
 
 class SQLTableBuilder:
@@ -57,18 +90,7 @@ class SQLTableBuilder:
         for dict_item in _converted_idx_list:
             _dict = {}
             for key, value in dict_item.items():
-                # Searches for correct y columns meeting criteria
-                if 'y' in key and 'delta' not in key:
-                    num = key[1:].split('_')[0]
-                    re1, re2 = key[1:].split('_')[1], key[1:].split('_')[2]
-                    num = str(num)
-                    if len(num) == 1:
-                        num = '0' + num
-                    y_num = 'y' + num
-                    k = '_'.join((y_num, re1, re2))
-                else:
-                    k = key
-                _dict[k] = value
+                _dict[sorted_column_name(key)] = value
                 # Creates the correctly ordered dictionary
                 ordered_dict = OrderedDict(sorted(_dict.items()))
             converted_data.append(ordered_dict)
@@ -109,6 +131,9 @@ class SQLTableBuilder:
             for key, value in line.items():
                 if key == 'index':
                     _ = {key: Column(Integer, primary_key=True, unique=True)}
+                elif key == 'x':
+                    # Indexed so that tables can be read back ordered by x
+                    _ = {key: Column(Float, index=True)}
                 elif key == 'num_of_ideal_func':
                     _ = {key: Column(String)}
                 elif key == 'name':
@@ -120,3 +145,168 @@ class SQLTableBuilder:
             data_to_load.append(data_d)
 
         return class_dict, data_to_load
+
+    def bulk_insert(self, engine, table, data_to_load, batch_size=10000):
+        """
+        Streams the data into the table through sqlalchemy Core executemany, in batches of batch_size
+        rows, within a single transaction. Avoids building one ORM object per row for large tables.
+        Input:
+            engine (Engine) - sqlalchemy engine to load the data with.
+            table (Table) - table to load, e.g. the __table__ of the class built from schema_create.
+            data_to_load (iterable) - dictionaries of data to load, i.e. output (2) of schema_create.
+            batch_size (int) - number of rows passed to each executemany call.
+        Output:
+            rows_per_second (float) - load rate reached, also written to the log.
+        """
+        rows = 0
+        rows_iter = iter(data_to_load)
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            while True:
+                batch = list(islice(rows_iter, batch_size))
+                if not batch:
+                    break
+                conn.execute(table.insert(), batch)
+                rows += len(batch)
+        elapsed = time.perf_counter() - start
+        rows_per_second = rows / elapsed if elapsed > 0 else float('inf')
+        logging.info(('Bulk loaded', table.name, rows, 'rows at rows/second:', rows_per_second))
+        return rows_per_second
+
+
+def file_content_hash(file_path, block_size=1 << 20):
+    """
+    Calculates the content hash of a file, reading it in blocks.
+    Input:
+        file_path (str) - path of file to hash.
+        block_size (int) - number of bytes read at a time.
+    Output:
+        content_hash (str) - hex digest of the file contents.
+    """
+    digest = hashlib.blake2b()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SourceRegistry:
+    """
+    Records the content hash of the csv file each table was loaded from, within the database itself.
+    In a persistent database this allows tables whose csv has not changed to be reused on later runs.
+    Input is the sqlalchemy engine of the database.
+    """
+    # Initiates new constructor
+    def __init__(self, engine):
+        self.engine = engine
+        metadata = MetaData()
+        self.table = Table('source_files', metadata,
+                           Column('table_name', String, primary_key=True),
+                           Column('content_hash', String))
+        metadata.create_all(engine)
+        self._hashes = dict()
+
+    def is_current(self, table_name, file_path):
+        """
+        Checks if the table exists and was loaded from a csv with the same contents as file_path.
+        Input:
+            table_name (str) - name of the table, e.g. 'Ideal'.
+            file_path (str) - path of the csv file the table is loaded from.
+        Output:
+            (boolean) - True if the table can be reused, False if it must be (re)loaded.
+        """
+        content_hash = file_content_hash(file_path)
+        self._hashes[table_name] = content_hash
+        if not inspect(self.engine).has_table(table_name):
+            return False
+        stmt = self.table.select().where(self.table.c.table_name == table_name)
+        with self.engine.connect() as conn:
+            row = conn.execute(stmt).fetchone()
+        return row is not None and row.content_hash == content_hash
+
+    def record(self, table_name):
+        """
+        Records the content hash found by is_current, once the table has been loaded.
+        Input:
+            table_name (str) - name of the table loaded.
+        Output:
+            None - hash is stored in the source_files table.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.table_name == table_name))
+            conn.execute(self.table.insert(), {'table_name': table_name,
+                                               'content_hash': self._hashes[table_name]})
+
+
+class SQLTableReader:
+    """
+    Reads a table loaded by SQLTableBuilder back for analysis, ordered by x through the table's x index.
+    Rows are fetched chunk_size at a time straight into float64 arrays, without building a Python object
+    copy of the whole table. Only numeric tables (e.g. Train, Ideal and Test) can be read.
+    Input:
+        engine (Engine) - sqlalchemy engine of the database.
+        table_name (str) - name of the table, e.g. 'Ideal'.
+        chunk_size (int) - number of rows fetched at a time.
+    """
+    # Initiates new constructor
+    def __init__(self, engine, table_name, chunk_size=65536):
+        self.engine = engine
+        self.table_name = table_name
+        self.chunk_size = chunk_size
+
+    def column_names(self):
+        """
+        Returns the table's data column names, i.e. excluding the x and index columns.
+        """
+        return [column['name'] for column in inspect(self.engine).get_columns(self.table_name)
+                if column['name'] not in ('x', 'index')]
+
+    def _select(self, columns):
+        """
+        Creates the statement selecting x and the columns, ordered by x.
+        """
+        quote = self.engine.dialect.identifier_preparer.quote
+        col_list = ', '.join(quote(col_name) for col_name in ['x'] + list(columns))
+        return 'SELECT {} FROM {} ORDER BY {}'.format(col_list, quote(self.table_name), quote('x'))
+
+    def iter_chunks(self, columns=None):
+        """
+        Generator mode, for stages that can consume the table a chunk at a time.
+        Input:
+            columns (list) - optional column names to read, defaults to all data columns.
+        Output:
+            Yields dataframes of at most chunk_size rows, with 'x' as the index.
+        """
+        columns = self.column_names() if columns is None else list(columns)
+        with self.engine.connect() as conn:
+            result = conn.exec_driver_sql(self._select(columns))
+            while True:
+                rows = result.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                values = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns) + 1)
+                yield pd.DataFrame(values[:, 1:], index=pd.Index(values[:, 0], name='x'), columns=columns)
+
+    def read_frame(self, columns=None, y_dtype=np.float64):
+        """
+        Reads the whole table into a float dataframe, filling a preallocated array chunk by chunk.
+        Input:
+            columns (list) - optional column names to read, defaults to all data columns.
+            y_dtype (dtype) - dtype of the data columns, default is float64. float32 halves their memory,
+            the x index is always float64.
+        Output:
+            df (dataframe) - data with 'x' as the index, sorted on index.
+        """
+        columns = self.column_names() if columns is None else list(columns)
+        quote = self.engine.dialect.identifier_preparer.quote
+        with self.engine.connect() as conn:
+            n_rows = conn.exec_driver_sql('SELECT COUNT(*) FROM ' + quote(self.table_name)).scalar()
+        x = np.empty(n_rows, dtype=np.float64)
+        values = np.empty((n_rows, len(columns)), dtype=y_dtype)
+        start = 0
+        for chunk in self.iter_chunks(columns):
+            stop = start + chunk.shape[0]
+            x[start:stop] = chunk.index.to_numpy()
+            values[start:stop] = chunk.to_numpy()
+            start = stop
+        return pd.DataFrame(values[:start], index=pd.Index(x[:start], name='x'), columns=columns, copy=False)
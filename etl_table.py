@@ -2,13 +2,23 @@
 # -*- coding: utf-8 -*-
 
 # PURPOSE:    This module serves to run file data munging from raw to SQL Lite-ready.
-# Files are read into dictionaries, their file names are added, strings are converted to float,
-# y columns are renamed according to the file name.
+# Files are read in a single pass, in chunks, straight into float column arrays. Their file names are
+# added, y columns are renamed according to the file name.
+# With a ParseCache (parse_cache module), parsed columns are memory-mapped from the cache on later runs.
+# df_from_columns creates the analysis dataframe straight from the parsed columns, float32_bytes_saved
+# reports the memory held by float32 columns.
 
 
 # Library imports
 import csv
 import re
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+# Imports own module
+from etl_sql import sorted_column_name
 
 
 class TableConverter:
@@ -16,59 +26,39 @@ class TableConverter:
     Executes data validation and munging of input data, to create dictionary passed to etl SQLTableBuilder object.
     Input is the dict_file from input_args_files.get_file_names()
     Output is the converted_data list containing final dataset dictionary of {transformed column name : data value}.
+    Optionally takes a ParseCache, so the csv is only parsed once while it is unchanged.
     """
 
     # Initiates new constructor
-    def __init__(self, dict_file):
+    def __init__(self, dict_file, parse_cache=None):
         self.dict_file = dict_file
+        self.parse_cache = parse_cache
 
-    def _csv_to_dict(self):
-        """
-        Creates csv_reader dictionary object from csv.
-        Appends the file name ('train', 'test' or 'ideal') in dictionary - e.g. 'name' : 'ideal'.
-        Input:
-            No explicit func input.
-            dict_file from input_args_files.get_file_names() is used in class constructor.
-        Output:
-            my_list (list) - list with csv_reader dictionary contained.
-        """
-        for file_name, file_path in self.dict_file.items():
-            # Reading in the file
-            my_list = []
-            with open(file_path) as csv_file:
-                csv_reader = csv.DictReader(csv_file)
-                # Converts the csv to a dict & appends file name (train, ideal or test)
-                for rows in map(dict, csv_reader):
-                    rows.update({'name': file_name})
-                    my_list.append(rows)
-            return my_list
-
-    def _col_name_check(self, _csv_to_dict):
+    def _col_name_check(self, _header_row):
         """
         Checks columns are (x, name, y), or if y that a func number is appended.
         Input:
-            _csv_to_dict (list) - output of func _csv_to_dict, take index [0].
-            I.e. _csv_to_dict = self._csv_to_dict()[0]
+            _header_row (dict) - dictionary keyed by the csv column names and 'name'.
         Output:
-            _csv_to_dict (list) - _csv_to_dict validated.
+            col_names (list) - validated column names.
         """
         col_names = ['x', 'y', 'name']
-        for key in _csv_to_dict.keys():
+        for key in _header_row.keys():
             # Validates column names, checks that 'y' columns have a digit
             if key not in col_names:
                 try:
-                    assert re.match('y\d+', key)
+                    assert re.match(r'y\d+', key)
                 except AssertionError:
                     raise AssertionError('Invalid column name')
-        return self._csv_to_dict()
+        return list(_header_row.keys())
 
     def _cast_string_to_float(self, _col_name_check):
         """
         Casts dictionary values to float datatype, raises error for invalid values.
         Input:
-            _col_name_check (list) - _csv_to_dict validated.
+            _col_name_check (iterable) - rows as dictionaries of {column name : string value}.
         Output:
-            my_list (list) - _csv_to_dict with validated values and strings recast to float.
+            my_list (list) - rows with validated values and strings recast to float.
         """
         my_list = []
         for line in _col_name_check:
@@ -90,7 +80,8 @@ class TableConverter:
         Creates mapping for each existing column name, to new column name with file name and 'func'
         appended.
         Input:
-            _cast_string_to_float (list) - output of _cast_string_to_float.
+            _cast_string_to_float (list) - rows (or the header row) keyed by column name, with 'name' holding
+            the file name.
         Output:
             _key_lookups (dict) - maps existing column name to new name.
         """
@@ -103,6 +94,109 @@ class TableConverter:
                 _key_lookups[key] = key
         return _key_lookups
 
+    def _chunk_to_float(self, header, chunk):
+        """
+        Casts a chunk of csv rows to a float64 array, raises error for invalid values.
+        Input:
+            header (list) - csv column names.
+            chunk (list) - csv rows (lists of strings).
+        Output:
+            values (array) - 2d array of rows x columns.
+        """
+        try:
+            return np.array(chunk, dtype=np.float64).reshape(len(chunk), len(header))
+        except ValueError:
+            # Re-checks the chunk row by row to report the invalid value
+            self._cast_string_to_float(dict(zip(header, row)) for row in chunk)
+            raise ValueError('Invalid data: row length does not match the column names')
+
+    def _iter_csv_chunks(self, chunk_size=65536, y_dtype=np.float64):
+        """
+        Reads the csv in a single pass, chunk_size rows at a time, straight into float column arrays.
+        Column names are validated and renamed once from the header - e.g. y2 -> y2_train_func.
+        Input:
+            chunk_size (int) - number of rows read per chunk.
+            y_dtype (dtype) - default is float64, float32 halves the memory of the y columns. x is
+            always float64, so that x values match exactly between tables.
+        Output:
+            Yields dictionaries of {renamed column name : float array} for each chunk.
+        """
+        for file_name, file_path in self.dict_file.items():
+            with open(file_path, newline='') as csv_file:
+                csv_reader = csv.reader(csv_file)
+                header = next(csv_reader)
+                # Checks column naming according to criteria and creates renamed column mapping
+                header_row = dict.fromkeys(header)
+                header_row['name'] = file_name
+                self._col_name_check(header_row)
+                key_lookups = self._create_column_keys([header_row])
+                col_names = [key_lookups[key] for key in header]
+                while True:
+                    rows = list(islice(csv_reader, chunk_size))
+                    if not rows:
+                        break
+                    # Skips blank lines, as csv.DictReader does
+                    chunk = [row for row in rows if row]
+                    if not chunk:
+                        continue
+                    values = self._chunk_to_float(header, chunk)
+                    # x stays float64, y columns are cast to y_dtype (no copy for float64)
+                    yield {col_name: values[:, col_num] if col_name == 'x'
+                           else values[:, col_num].astype(y_dtype, copy=False)
+                           for col_num, col_name in enumerate(col_names)}
+            return
+
+    def _parse_columns(self, chunk_size=65536, y_dtype=np.float64):
+        """
+        Parses the whole csv into float column arrays, without the parse cache.
+        """
+        chunks = list(self._iter_csv_chunks(chunk_size, y_dtype))
+        if not chunks:
+            return dict()
+        return {col_name: np.concatenate([chunk[col_name] for chunk in chunks]) for col_name in chunks[0]}
+
+    def _cached_columns(self):
+        """
+        Returns the float64 column arrays from the parse cache, parsing and caching the csv if needed.
+        """
+        return self.parse_cache.columns(next(iter(self.dict_file.values())), self._parse_columns)
+
+    def iter_column_chunks(self, chunk_size=65536, y_dtype=np.float64):
+        """
+        Yields the csv's columns chunk_size rows at a time, from the parse cache if set, else by parsing
+        the csv (see _iter_csv_chunks).
+        Input:
+            chunk_size (int) - number of rows per chunk.
+            y_dtype (dtype) - default is float64, float32 halves the memory of the y columns. x is
+            always float64, so that x values match exactly between tables.
+        Output:
+            Yields dictionaries of {renamed column name : float array} for each chunk.
+        """
+        if self.parse_cache is None:
+            yield from self._iter_csv_chunks(chunk_size, y_dtype)
+            return
+        columns = self._cached_columns()
+        n_rows = len(next(iter(columns.values()), []))
+        for start in range(0, n_rows, chunk_size):
+            yield {col_name: values[start:start + chunk_size] if col_name == 'x'
+                   else values[start:start + chunk_size].astype(y_dtype, copy=False)
+                   for col_name, values in columns.items()}
+
+    def table_to_columns(self, chunk_size=65536, y_dtype=np.float64):
+        """
+        Reads the whole csv into float column arrays. From the parse cache, float64 columns are returned
+        as memory-mapped arrays without being copied.
+        Input:
+            chunk_size (int) - number of rows read per chunk.
+            y_dtype (dtype) - dtype of the y columns, see iter_column_chunks.
+        Output:
+            columns (dict) - maps renamed column name to float array.
+        """
+        if self.parse_cache is not None:
+            return {col_name: values if col_name == 'x' else values.astype(y_dtype, copy=False)
+                    for col_name, values in self._cached_columns().items()}
+        return self._parse_columns(chunk_size, y_dtype)
+
     def table_to_dict(self):
         """
         Executes supporting functions.
@@ -112,19 +206,55 @@ class TableConverter:
         Output:
             converted_data (list) - list contains cleaned, validated data with renamed columns
         """
-        # Converts csv to dictionary object
-        csv_to_dict = self._csv_to_dict()
-        # Checks column naming according to criteria
-        col_name_check = self._col_name_check(csv_to_dict[0])
-        # Casts data values to float
-        cast_string_to_float = self._cast_string_to_float(col_name_check)
-        # Creates renamed column mapping dictionary
-        key_lookups = self._create_column_keys(cast_string_to_float)
-        # Creates new dictionary object with correctly named columns and float data
         converted_data = []
-        for line in cast_string_to_float:
-            my_dict = dict()
-            for key, value in key_lookups.items():
-                my_dict.update({value: line[key]})
+        for chunk in self.iter_column_chunks():
+            converted_data.extend(self.columns_to_dict(chunk))
+        return converted_data
+
+    def columns_to_dict(self, columns):
+        """
+        Converts column arrays from iter_column_chunks or table_to_columns to the list of row dictionaries
+        passed to the etl SQLTableBuilder object, with the file name added to each row.
+        Input:
+            columns (dict) - maps renamed column name to float array.
+        Output:
+            converted_data (list) - one dictionary of {column name : float value} per row.
+        """
+        file_name = next(iter(self.dict_file))
+        col_names = list(columns.keys())
+        converted_data = []
+        # Creates new dictionary object with correctly named columns and float data
+        for values in zip(*(columns[col_name].tolist() for col_name in col_names)):
+            my_dict = dict(zip(col_names, values))
+            my_dict['name'] = file_name
             converted_data.append(my_dict)
         return converted_data
+
+
+def df_from_columns(columns):
+    """
+    Creates a dataframe directly from TableConverter column arrays, without the SQLite round-trip.
+    Columns are named and ordered as they are by df_create, with 'x' as the index.
+    Input:
+        columns (dict) - output of TableConverter.table_to_columns().
+    Output:
+        dataframe sorted on index.
+    """
+    df = pd.DataFrame({sorted_column_name(key): values for key, values in columns.items()})
+    df = df[sorted(df.columns)]
+    df.set_index('x', inplace=True)
+    # Stable sort keeps rows with the same x in file order, as the database x index does
+    df.sort_index(inplace=True, kind='mergesort')
+    return df
+
+
+def float32_bytes_saved(frames):
+    """
+    Reports the memory saved by holding the dataframes' float32 columns rather than float64 columns.
+    Input:
+        frames (list) - dataframes.
+    Output:
+        saved (int) - number of bytes saved.
+    """
+    return sum(int(df[col_name].to_numpy().nbytes) for df in frames
+               for col_name in df.columns if df[col_name].dtype == np.float32)
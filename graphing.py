@@ -5,6 +5,7 @@
 # (1) Creates graph folder.
 # This is either the main graph or additional_graphs folder.
 # (2) Prepares and presents the data from the test function in Bokeh graphs.
+# Graph data is collected into figure specs first, which are then rendered (optionally in parallel).
 
 
 # Library imports
@@ -12,10 +13,15 @@ from bokeh.plotting import figure
 from bokeh.plotting import output_file
 from bokeh.plotting import save
 from bokeh.palettes import Spectral11
+import numpy as np
 import os
 
 # Imports own modules
 from test import TestFunctionReturner
+from render import render_figures
+from dashboard import data_source
+from result_cache import memoized
+from instrument import instrumented
 
 
 # ---------------------Functions---------------------
@@ -38,6 +44,40 @@ def create_graph_folder(graph_folder_name='main_graphs'):
         os.makedirs(final_directory)
 
 
+def lttb_indices(x, y, n_out):
+    """
+    Selects the points of a line to keep with the largest-triangle-three-buckets algorithm, which
+    preserves the visual shape of the line. The first and last points are always kept.
+    Input:
+        x, y (arrays) - line co-ordinates, sorted on x.
+        n_out (int) - target number of points, lines with no more points than this are kept whole.
+    Output:
+        idx (array) - sorted indices of the points to keep.
+    """
+    n = len(x)
+    if n_out is None or n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Points between the first and last are split into n_out - 2 buckets, one point kept per bucket
+    edges = (np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Keeps the point forming the largest triangle with the previously kept point and the average
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        idx[bucket + 1] = a
+    return idx
+
+
 # -----------------------Classes----------------------
 
 
@@ -53,6 +93,8 @@ class IdealPlotter(TestFunctionReturner):
         # Calls parent's (TrainFunctionReturner) constructor
         super().__init__(train_df, ideal_df, test_df, sq_root_number)
 
+    @instrumented
+    @memoized('train_df', 'ideal_df', 'test_df')
     def get_plot_data(self):
         """
         Retrieves and prepares the data for mapped_plotted_fns.
@@ -86,82 +128,160 @@ class IdealPlotter(TestFunctionReturner):
             df_list.append(all_results)
         return df_list
 
-    def mapped_plotted_fns(self, unmapped_in_range=False):
+    def _figure_specs(self, unmapped_in_range=False, line_points=5000):
         """
-        Creates separate Bokeh graphs for each of the 4 matched test functions.
+        Creates the figure spec of each function's graph, for rendering by _render_ideal_figure.
         Input:
-            unmapped_in_range (boolean) - default is False, if True will show relevant points lying
+            unmapped_in_range (boolean) - default is False, if True will include relevant points lying
             within range that are still unmapped by the function.
+            line_points (int) - target number of points of the ideal function and boundary lines, which
+            are downsampled with lttb_indices. None keeps every point. Test points are never dropped.
         Output:
-            1 saved Bokeh graph representing each function.
+            specs (list) - one dictionary of plot data, title and file name per function.
         """
         # Creates the data for plotting by running above function
         get_plot_data = self.get_plot_data()
         num_lines = len(get_plot_data)
         palette = Spectral11[0:5]
+        graphs_directory = os.getcwd() + '/main_graphs/'
 
+        specs = []
         for fn_num in range(num_lines):
-            # Creates a graph for each function
-            # Retrieves upper and lower bound line data
-            borders_to_plot = get_plot_data[fn_num][['upper_bound', 'lower_bound']]
-            # Retrieves function data to plot
-            fn_to_plot = get_plot_data[fn_num]['y_ideal']
+            plot_data = get_plot_data[fn_num]
             # Retrieves the function name
-            name = get_plot_data[fn_num]['name'].unique()[0]
+            name = plot_data['name'].unique()[0]
             # Retrieves the square root applied
-            square_root = str(get_plot_data[fn_num]['square_root'].unique()[0])
+            square_root = str(plot_data['square_root'].unique()[0])
             # Creates title for graph
             _title = ' plotted with upper and lower bounds, mapped functions: factor square root '
-            # Bokeh figure instantiation
-            p = figure(width=1000,
-                       height=750,
-                       x_axis_label='x',
-                       y_axis_label='y')
-            # Creating multiline graph for upper and lower bounds -> 2 lines
-            p.multi_line(xs=[borders_to_plot.index.values] * 2,
-                         ys=[borders_to_plot[col_name] for col_name in borders_to_plot.columns],
-                         line_color=palette[fn_num],
-                         line_width=4,
-                         legend_label=name.replace('_', ' ') + ' upper & lower bounds')
-            # Creating single line for function -> 3 lines in total
-            p.line(x=fn_to_plot.index,
-                   y=fn_to_plot.values,
-                   line_color=palette[fn_num + 1],
-                   line_width=2,
-                   legend_label=name.replace('_', ' '))
-
-            # Default is to only plot mapped data points
-            mapped_plot_data = get_plot_data[fn_num][get_plot_data[fn_num]['mapped'] == 1]
-            # Plots mapped data points as circles
-            p.circle(x=mapped_plot_data.index,
-                     y=mapped_plot_data['y_test_func'].values,
-                     size=3,
-                     color="#000000",
-                     legend_label='mapped funcs',
-                     alpha=0.8)
-            # Creates graph title and sets graph formatting
-            title_label = name.replace('_', ' ') + _title + square_root
-            p.title.text_font_size = "14px"
-
             # Creates filename
             _filename = name + '.html'
-            graphs_directory = os.getcwd() + '/main_graphs/'
-            # Default is to only plot mapped data points - if unmapped_in_range used then will plot
-            # unmapped points as squares
+            # Default is to only plot mapped data points
+            mapped_plot_data = plot_data[plot_data['mapped'] == 1]
+            # Downsamples each line separately, keeping its shape
+            x = plot_data.index.values
+            lines = dict()
+            for col_name in ['upper_bound', 'lower_bound', 'y_ideal']:
+                y = plot_data[col_name].values
+                keep = lttb_indices(x, y, line_points)
+                lines[col_name] = (x[keep], y[keep])
+            spec = {'name': name,
+                    'bounds_colour': palette[fn_num],
+                    'line_colour': palette[fn_num + 1],
+                    'upper_bound': lines['upper_bound'],
+                    'lower_bound': lines['lower_bound'],
+                    'y_ideal': lines['y_ideal'],
+                    'mapped_x': mapped_plot_data.index.values,
+                    'mapped_y': mapped_plot_data['y_test_func'].values,
+                    'unmapped_x': None,
+                    'unmapped_y': None}
+            # If unmapped_in_range used then will also plot unmapped points
             if unmapped_in_range:
-                unmapped_plot_data = get_plot_data[fn_num][get_plot_data[fn_num]['mapped'] == 0]
-                p.square(x=unmapped_plot_data.index,
-                         y=unmapped_plot_data['y_test_func'].values,
-                         size=5,
-                         color='#1C5771',
-                         legend_label='unmapped funcs',
-                         alpha=0.8)
+                unmapped_plot_data = plot_data[plot_data['mapped'] == 0]
+                spec['unmapped_x'] = unmapped_plot_data.index.values
+                spec['unmapped_y'] = unmapped_plot_data['y_test_func'].values
                 _title = _title.replace(':', ' and unmapped functions:')
-                title_label = name.replace('_', ' ') + _title + square_root
                 _filename = name + '_unmapped' + '.html'
+            spec['title'] = name.replace('_', ' ') + _title + square_root
+            spec['filename'] = graphs_directory + _filename
+            spec['tab'] = _filename.replace('.html', '')
+            specs.append(spec)
+        return specs
 
-            p.title = title_label
-            p.title_location = 'above'
-            p.add_layout(p.legend[0], 'right')
-            output_file(graphs_directory + _filename)
-            save(p)
+    @instrumented
+    def mapped_plotted_fns(self, unmapped_in_range=False, processes=1, line_points=5000, dashboard=None):
+        """
+        Creates separate Bokeh graphs for each of the 4 matched test functions.
+        Input:
+            unmapped_in_range (boolean) - default is False, if True will show relevant points lying
+            within range that are still unmapped by the function.
+            processes (int) - default is 1, else the graphs are serialized and saved on a process pool.
+            line_points (int) - default is 5000, target number of points per ideal function and boundary
+            line. None plots every point.
+            dashboard (Dashboard) - optional, if given the graphs are added to it as tabs instead of
+            being saved as separate files.
+        Output:
+            1 saved Bokeh graph representing each function.
+        """
+        specs = self._figure_specs(unmapped_in_range, line_points)
+        if dashboard is None:
+            render_figures(_render_ideal_figure, specs, processes)
+        else:
+            for spec in specs:
+                dashboard.add(spec['tab'], _build_ideal_figure(spec, dashboard))
+
+
+def _build_ideal_figure(spec, dashboard=None):
+    """
+    Builds the Bokeh graph of one function from its spec (see IdealPlotter._figure_specs).
+    Input:
+        spec (dict) - plot data, title and file name of the graph.
+        dashboard (Dashboard) - optional, shares the function's data sources between its graphs.
+    Output:
+        p (figure) - Bokeh figure.
+    """
+    name = spec['name']
+    # Data sources, shared by the mapped and unmapped graphs of the function within a dashboard
+    bounds = data_source(dashboard, (name, 'bounds'), {'xs': [spec['upper_bound'][0], spec['lower_bound'][0]],
+                                                       'ys': [spec['upper_bound'][1], spec['lower_bound'][1]]})
+    ideal = data_source(dashboard, (name, 'y_ideal'), {'x': spec['y_ideal'][0], 'y': spec['y_ideal'][1]})
+    mapped = data_source(dashboard, (name, 'mapped'), {'x': spec['mapped_x'], 'y': spec['mapped_y']})
+
+    # Bokeh figure instantiation
+    p = figure(width=1000,
+               height=750,
+               x_axis_label='x',
+               y_axis_label='y')
+    # Creating multiline graph for upper and lower bounds -> 2 lines
+    p.multi_line(xs='xs',
+                 ys='ys',
+                 source=bounds,
+                 line_color=spec['bounds_colour'],
+                 line_width=4,
+                 legend_label=name.replace('_', ' ') + ' upper & lower bounds')
+    # Creating single line for function -> 3 lines in total
+    p.line(x='x',
+           y='y',
+           source=ideal,
+           line_color=spec['line_colour'],
+           line_width=2,
+           legend_label=name.replace('_', ' '))
+
+    # Plots mapped data points as circles
+    p.circle(x='x',
+             y='y',
+             source=mapped,
+             size=3,
+             color="#000000",
+             legend_label='mapped funcs',
+             alpha=0.8)
+    # Sets graph formatting
+    p.title.text_font_size = "14px"
+
+    # Plots unmapped points in range as squares, if included
+    if spec['unmapped_x'] is not None:
+        unmapped = data_source(dashboard, (name, 'unmapped'), {'x': spec['unmapped_x'], 'y': spec['unmapped_y']})
+        p.square(x='x',
+                 y='y',
+                 source=unmapped,
+                 size=5,
+                 color='#1C5771',
+                 legend_label='unmapped funcs',
+                 alpha=0.8)
+
+    p.title = spec['title']
+    p.title_location = 'above'
+    p.add_layout(p.legend[0], 'right')
+    return p
+
+
+def _render_ideal_figure(spec):
+    """
+    Builds and saves the Bokeh graph of one function from its spec as a standalone file.
+    Input:
+        spec (dict) - plot data, title and file name of the graph.
+    Output:
+        Saved Bokeh graph, no explicit return value.
+    """
+    output_file(spec['filename'])
+    save(_build_ideal_figure(spec))
@@ -0,0 +1,214 @@
+# incremental_clusters.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module clusters unmapped test points incrementally, for test data arriving in batches.
+# The DB-Scan state (neighbour counts, core points, cluster labels and running cluster centroids) is kept
+# between batches, so each new point only looks up its neighbours in the adjacent grid cells, rather than
+# re-clustering all points seen so far.
+# Core points and the clusters they form are the same as batch DB-Scan over all points; a border point
+# reachable from several clusters keeps the first cluster that reached it.
+
+
+# Library imports
+import math
+
+import numpy as np
+import pandas as pd
+
+
+class IncrementalClusters:
+    """
+    DB-Scan clustering which is updated one batch of points at a time.
+    Input:
+        eps, min_samples - DB-Scan parameters, defaulted to 500 and 2 as UnmappedClusters.
+    Output:
+        clustered_df and cluster_centers, in the same format as UnmappedClusters._clustered_df and
+        UnmappedClusters._cluster_centers.
+    """
+    # Initiates new constructor
+    def __init__(self, eps=500, min_samples=2):
+        self.eps = eps
+        self.min_samples = min_samples
+        # Per point state
+        self._x, self._y = [], []
+        self._counts = []
+        self._core = []
+        self._cluster = []
+        # Per cluster state, only up to date for the root of merged clusters
+        self._parent = []
+        self._sum_x, self._sum_y, self._size = [], [], []
+        # Grid of eps sized cells -> (point numbers, x values, y values)
+        self._cells = dict()
+
+    def _cell(self, x, y):
+        """
+        Returns the grid cell of a co-ordinate.
+        """
+        return math.floor(x / self.eps), math.floor(y / self.eps)
+
+    def _neighbours(self, x, y):
+        """
+        Finds the points within eps of x, y, searching only the surrounding grid cells.
+        Input:
+            x, y (float) - co-ordinates.
+        Output:
+            neighbours (list) - point numbers.
+        """
+        cell_x, cell_y = self._cell(x, y)
+        neighbours = []
+        for cell in [(cell_x + dx, cell_y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]:
+            if cell in self._cells:
+                points, xs, ys = self._cells[cell]
+                within = np.hypot(np.asarray(xs) - x, np.asarray(ys) - y) <= self.eps
+                neighbours.extend(np.asarray(points)[within].tolist())
+        return neighbours
+
+    def _find(self, cluster):
+        """
+        Returns the root of a cluster, following merged clusters.
+        """
+        while self._parent[cluster] != cluster:
+            self._parent[cluster] = self._parent[self._parent[cluster]]
+            cluster = self._parent[cluster]
+        return cluster
+
+    def _new_cluster(self):
+        """
+        Creates an empty cluster, returning its number.
+        """
+        self._parent.append(len(self._parent))
+        self._sum_x.append(0.0)
+        self._sum_y.append(0.0)
+        self._size.append(0)
+        return len(self._parent) - 1
+
+    def _merge(self, cluster_a, cluster_b):
+        """
+        Merges two clusters, combining their running centroid sums. Returns the root of the merged cluster.
+        """
+        cluster_a, cluster_b = self._find(cluster_a), self._find(cluster_b)
+        if cluster_a == cluster_b:
+            return cluster_a
+        root, child = min(cluster_a, cluster_b), max(cluster_a, cluster_b)
+        self._parent[child] = root
+        self._sum_x[root] += self._sum_x[child]
+        self._sum_y[root] += self._sum_y[child]
+        self._size[root] += self._size[child]
+        return root
+
+    def _assign(self, point, cluster):
+        """
+        Assigns a point to a cluster, adding it to the cluster's running centroid sums.
+        """
+        cluster = self._find(cluster)
+        self._cluster[point] = cluster
+        self._sum_x[cluster] += self._x[point]
+        self._sum_y[cluster] += self._y[point]
+        self._size[cluster] += 1
+
+    def _add_point(self, x, y):
+        """
+        Adds one point, updating the core points and clusters around it.
+        """
+        neighbours = self._neighbours(x, y)
+        point = len(self._x)
+        self._x.append(x)
+        self._y.append(y)
+        self._counts.append(len(neighbours) + 1)
+        self._core.append(False)
+        self._cluster.append(-1)
+        points, xs, ys = self._cells.setdefault(self._cell(x, y), ([], [], []))
+        points.append(point)
+        xs.append(x)
+        ys.append(y)
+
+        # Finds the points which have become core points by adding this point
+        new_cores = []
+        for neighbour in neighbours:
+            self._counts[neighbour] += 1
+            if not self._core[neighbour] and self._counts[neighbour] >= self.min_samples:
+                new_cores.append(neighbour)
+        if self._counts[point] >= self.min_samples:
+            new_cores.append(point)
+
+        for core in new_cores:
+            self._core[core] = True
+            core_neighbours = neighbours if core == point else self._neighbours(self._x[core], self._y[core])
+            # Joins the clusters of all core points in reach, or starts a new cluster
+            cluster = self._cluster[core] if self._cluster[core] != -1 else None
+            for neighbour in core_neighbours:
+                if self._core[neighbour] and self._cluster[neighbour] != -1:
+                    if cluster is None:
+                        cluster = self._find(self._cluster[neighbour])
+                    else:
+                        cluster = self._merge(cluster, self._cluster[neighbour])
+            if cluster is None:
+                cluster = self._new_cluster()
+            if self._cluster[core] == -1:
+                self._assign(core, cluster)
+            # Points in reach which were noise become border points of the cluster
+            for neighbour in core_neighbours:
+                if self._cluster[neighbour] == -1:
+                    self._assign(neighbour, cluster)
+
+        # Otherwise the point is a border point of a core neighbour's cluster, or noise
+        if self._cluster[point] == -1:
+            for neighbour in neighbours:
+                if self._core[neighbour]:
+                    self._assign(point, self._cluster[neighbour])
+                    break
+
+    def add_points(self, df):
+        """
+        Adds a batch of points to the clustering.
+        Input:
+            df (dataframe) - unmapped points indexed on x with a y_test_func column, as
+            TestFunctionReturner.unmapped_fns_set.
+        Output:
+            None - clustering state is updated.
+        """
+        for x, y in zip(df.index.to_numpy(dtype=np.float64).tolist(),
+                        df['y_test_func'].to_numpy(dtype=np.float64).tolist()):
+            self._add_point(x, y)
+
+    def _label_numbers(self):
+        """
+        Returns the cluster root of each point and the cluster number of each root, numbered in order
+        of each cluster's first point.
+        """
+        roots = [self._find(cluster) if cluster != -1 else -1 for cluster in self._cluster]
+        numbers = dict()
+        for root in roots:
+            if root != -1 and root not in numbers:
+                numbers[root] = len(numbers)
+        return roots, numbers
+
+    def clustered_df(self, filter_noise=False):
+        """
+        Returns all points added so far with their cluster number.
+        Input:
+            filter_noise (boolean) - default is False, if True points not belonging to a cluster are omitted.
+        Output:
+            _df (dataframe) - x, y_test_func and dbscan_labels (cluster number as str, -1 for noise).
+        """
+        roots, numbers = self._label_numbers()
+        _df = pd.DataFrame({'x': self._x, 'y_test_func': self._y,
+                            'dbscan_labels': [str(numbers.get(root, -1)) for root in roots]},
+                           columns=['x', 'y_test_func', 'dbscan_labels'])
+        if filter_noise:
+            _df = _df[_df['dbscan_labels'] != '-1']
+        _df = _df.sort_values(by=['dbscan_labels'], kind='stable')
+        return _df.reset_index(drop=True)
+
+    def cluster_centers(self):
+        """
+        Returns the average x and y co-ordinates per cluster, from the running centroid sums.
+        Output:
+            _df (dataframe) - cluster number (as str) with average x, y co-ordinates, ordered on cluster number.
+        """
+        _, numbers = self._label_numbers()
+        _df = pd.DataFrame({'dbscan_labels': [str(number) for number in numbers.values()],
+                            'x_bar': [self._sum_x[root] / self._size[root] for root in numbers],
+                            'y_bar': [self._sum_y[root] / self._size[root] for root in numbers]},
+                           columns=['dbscan_labels', 'x_bar', 'y_bar'])
+        return _df.sort_values(by=['dbscan_labels'], kind='stable').reset_index(drop=True)
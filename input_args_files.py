@@ -4,7 +4,7 @@
 # PURPOSE:    This module serves to fulfil 2 criteria:
 # (1) Retrieves the input argument provided by the user when running main.py.
 # The input argument needs to be the single folder location of the 'train', 'test' and 'ideal' functions
-# files, so that the program can continue.
+# files, so that the program can continue. batch.py accepts many folders or glob patterns instead.
 
 # (2) Module checks that all 3 files are there and correctly named
 # after the folder location is inputted.
@@ -12,19 +12,27 @@
 
 # Library imports
 import argparse
+import glob
 import os
 import fnmatch
 from pathlib import Path
 
 
-def get_input_args():
+def get_input_options():
     """
-    Retrieves and parses the command line argument provided by the user when running the program from the terminal. 
+    Retrieves and parses all command line arguments provided by the user when running the program from the
+    terminal.
     Folder is --dir
+    --in-memory loads the csv data straight into dataframes, with SQLite written to in the background.
+    --db keeps the SQLite database in a file between runs.
+    --metrics and --trace-memory configure the stage metrics.
+    --dashboard saves all graphs as tabs of one HTML file.
+    --float32 holds the y data as float32, halving its memory.
+    --parse-cache and --no-parse-cache configure the binary cache of parsed csv files.
     Input:
         None - uses argparse module to create and store command line arguments
     Output:
-        args - string variable storing command line arguments
+        args - argparse namespace storing command line arguments
     """
     # Instantiates the ArgumentParser object
     parser = argparse.ArgumentParser(description='Provide directory with train, test and ideal functions')
@@ -32,12 +40,64 @@ def get_input_args():
     # Creates command line argument using add_argument() from ArgumentParser object
     # Argument: Datasets directory
     parser.add_argument('--dir', type=str, help='Path to folder with train, test and ideal functions')
-    # Parses directory input
-    args = parser.parse_args()
+    # Argument: Pipeline mode skipping the SQLite round-trip
+    parser.add_argument('--in-memory', action='store_true',
+                        help='Analyse the csv data directly, writing to SQLite in the background')
+    # Argument: Persistent database file, reusing tables whose csv has not changed
+    parser.add_argument('--db', type=str, default=None,
+                        help='Path to a SQLite database file kept between runs, only changed csv files are reloaded')
+    # Argument: Separate file for the stage metrics JSON lines
+    parser.add_argument('--metrics', type=str, default=None,
+                        help='Path to write stage metrics to, instead of logfile.log')
+    # Argument: Peak memory tracing per stage
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Record the peak traced memory of each stage (slower)')
+    # Argument: Single dashboard file for all graphs
+    parser.add_argument('--dashboard', type=str, default=None,
+                        help='Path to save all graphs to as one tabbed HTML file, instead of one file per graph')
+    # Argument: Worker processes for the square root sweep and for saving the graphs
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Number of processes running the square root sweep and saving the graphs')
+    # Argument: Compact precision mode for the y data
+    parser.add_argument('--float32', action='store_true',
+                        help='Hold y data as float32 to halve its memory, checking the ideal function selection')
+    # Argument: Binary cache of parsed csv files
+    parser.add_argument('--parse-cache', type=str, default='parse_cache',
+                        help='Folder caching the parsed csv files, memory-mapped on later runs while unchanged')
+    parser.add_argument('--no-parse-cache', action='store_true',
+                        help='Always parse the csv files, without reading or writing the parse cache')
+    # Parses inputs
+    return parser.parse_args()
+
+
+def get_input_args():
+    """
+    Retrieves and parses the command line argument provided by the user when running the program from the terminal. 
+    Folder is --dir
+    Input:
+        None - uses argparse module to create and store command line arguments
+    Output:
+        args - string variable storing command line arguments
+    """
     # Retrieves directory
-    args = args.dir
+    args = get_input_options().dir
     return args
 
+def expand_folders(patterns):
+    """
+    Expands folder paths and glob patterns (e.g. 'data/run_*') to the folders they match, for batch mode.
+    Input:
+        patterns (list) - folder paths or glob patterns
+    Output:
+        folders (list) - matched folders, sorted within each pattern, each listed once
+    """
+    folders = []
+    for pattern in patterns:
+        for folder in sorted(glob.glob(pattern)):
+            if os.path.isdir(folder) and folder not in folders:
+                folders.append(folder)
+    return folders
+
 def valid_path_inputted(args):
     """
     Asserts that the path from get_input_args() is a valid one
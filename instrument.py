@@ -0,0 +1,123 @@
+# instrument.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module records metrics for each stage of the program run.
+# Wall time, CPU time, the process's peak memory so far and row counts are written as one JSON line per
+# stage to the 'metrics' logger - by default this goes to logfile.log, or to a separate metrics file if
+# configured. The peak memory of the stage itself is only recorded while tracemalloc is tracing (enabled by
+# main's --trace-memory).
+
+
+# Library imports
+import functools
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+metrics_logger = logging.getLogger('metrics')
+
+# Peak traced memory of each open stage, lost when a nested stage resets the tracemalloc peak
+_lost_peaks = []
+
+
+def log_to_file(file_path):
+    """
+    Writes the metrics JSON lines to their own file instead of logfile.log.
+    Input:
+        file_path (str) - path of the metrics file, appended to.
+    Output:
+        None - handler is added to the metrics logger.
+    """
+    handler = logging.FileHandler(file_path)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    metrics_logger.addHandler(handler)
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False
+
+
+def _process_peak_rss_bytes():
+    """
+    Returns the peak resident memory of the process since it started (not of one stage), or None where
+    unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _count_rows(result):
+    """
+    Returns the number of rows in a stage's result, if it has one.
+    """
+    if hasattr(result, 'shape'):
+        return int(result.shape[0])
+    if isinstance(result, (list, tuple, dict)):
+        return len(result)
+    return None
+
+
+class stage:
+    """
+    Context manager recording the metrics of one stage, e.g.
+        with stage('csv_parse') as record:
+            ...
+            record.rows = len(data)
+    Input:
+        name (str) - name of the stage.
+        rows (int) - optional number of rows processed, can also be set on the object within the block.
+    Output:
+        JSON line of stage name, wall and CPU seconds, rows, the process's peak memory so far, the stage's
+        peak traced memory (while tracing) and whether the stage succeeded.
+    """
+    # Initiates new constructor
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self._tracing = tracemalloc.is_tracing()
+        if self._tracing:
+            # Keeps the enclosing stage's peak before resetting the peak for this stage
+            if _lost_peaks:
+                _lost_peaks[-1] = max(_lost_peaks[-1], tracemalloc.get_traced_memory()[1])
+            _lost_peaks.append(0)
+            tracemalloc.reset_peak()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record = {'stage': self.name,
+                  'wall_seconds': time.perf_counter() - self._start_wall,
+                  'cpu_seconds': time.process_time() - self._start_cpu,
+                  'rows': self.rows,
+                  'process_peak_rss_bytes': _process_peak_rss_bytes(),
+                  'ok': exc_type is None}
+        if self._tracing:
+            record['peak_traced_bytes'] = max(tracemalloc.get_traced_memory()[1], _lost_peaks.pop())
+        if metrics_logger.isEnabledFor(logging.INFO):
+            metrics_logger.info(json.dumps(record))
+        return False
+
+
+def instrumented(method):
+    """
+    Decorator recording the metrics of each call to a method, as stage '<class name>.<method name>'.
+    Rows are taken from the length of the returned dataframe, list or dictionary.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with stage(type(self).__name__ + '.' + method.__name__) as record:
+            result = method(self, *args, **kwargs)
+            record.rows = _count_rows(result)
+        return result
+    return wrapper
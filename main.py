@@ -2,149 +2,284 @@
 # -*- coding: utf-8 -*-
 
 # Library imports
+import numpy as np
 import pandas as pd
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import Session
 from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import time
+import tracemalloc
 
 # Imports own modules
 import input_args_files
 import etl_table
+from etl_table import df_from_columns
+from etl_table import float32_bytes_saved
 import etl_sql
+import instrument
+from instrument import stage
+from train import TrainFunctionReturner
 from test import TestFunctionReturner
 from graphing import IdealPlotter
 from graphing import create_graph_folder
+from dashboard import Dashboard
+from pipeline import PipelineContext
+from parse_cache import ParseCache
 from summary import SummaryReporter
 from unmapped import UnmappedClusters
 
-# Instantiates sqlalchemy Base and engine
+# Instantiates sqlalchemy Base and engine. The in-memory database is shared by all threads, so that
+# tables can be written by the background SQLite sink
 Base = declarative_base()
-engine = create_engine("sqlite://", echo=True)
+engine = create_engine("sqlite://", echo=True, connect_args={'check_same_thread': False}, poolclass=StaticPool)
 Base.metadata.create_all(engine)
 
-# Creates dataframe for data loaded by sqlalchemy within the main namespace
-def df_create(table_name):
+# Tables with at least this many rows are loaded with the bulk (Core executemany) path, smaller
+# tables through the ORM session
+BULK_LOAD_MIN_ROWS = 1000
+
+
+def load_table(table_ins, table_class, data_to_load):
     """
-    Creates a dataframe from sqlite db, with 'x' as the index.
+    Loads the data into the table created for table_class.
     Input:
-        table_name (str) - name of table
+        table_ins (SQLTableBuilder) - table object the data was created by.
+        table_class (class) - sqlalchemy class created from the table metadata.
+        data_to_load (list) - dictionaries of data to load.
     Output:
-        dataframe sorted on index.
+        None - data is added to the table.
     """
-    stmt = "SELECT * FROM " + table_name
-    with engine.connect() as conn:
-        e_stmt = conn.execute(stmt)
-    df = pd.DataFrame(e_stmt.fetchall())
-    df.columns = e_stmt.keys()
-    df.set_index('x', inplace=True)
-    df.sort_index(inplace=True)
-    df = df.drop(['index'], axis=1)
-    return df
-
-
-def main():
-    # Initiate logfile
-    logging.basicConfig(filename="logfile.log", level=logging.INFO)
-    start = time.time()
-    logging.info('---Started---')
-
-    # Gets the input arguments
-    _input = input_args_files.get_input_args()
-
-    # Checks that a valid input has been received
-    input_args_files.valid_path_inputted(_input)
-
-    # Checks all the files are in inputted folder
-    input_args_files.file_counter(_input)
-
-    # Creates dictionary mapping file path to test, train and ideal
-    files_folder = input_args_files.get_file_names(_input)
-
-    # Checks that above dictionary was created
-    _ = isinstance(files_folder, dict)
-
-    # Stores the file names and paths in variables
-    test, train, ideal = files_folder['test'], files_folder['train'], files_folder['ideal']
-
-    # Creates the dataset dictionaries for each of test, train and ideal
-    test_d, train_d, ideal_d = etl_table.TableConverter(test).table_to_dict(), etl_table.TableConverter(train).table_to_dict(), \
-                               etl_table.TableConverter(ideal).table_to_dict()
-
-    # Instantiates the SQL lite table objects
-    test_ins = etl_sql.SQLTableBuilder(test_d)
-    train_ins = etl_sql.SQLTableBuilder(train_d)
-    ideal_ins = etl_sql.SQLTableBuilder(ideal_d)
-
-    # Retrieves the SQL lite metadata
-    my_test_class = type(test_ins.schema_create()[0]['clsname'], (Base,), test_ins.schema_create()[0])
-    my_train_class = type(train_ins.schema_create()[0]['clsname'], (Base,), train_ins.schema_create()[0])
-    my_ideal_class = type(ideal_ins.schema_create()[0]['clsname'], (Base,), ideal_ins.schema_create()[0])
-
-    # Creates schemas
-    Base.metadata.create_all(engine)
-    data_test = test_ins.schema_create()[1]
-    data_train = train_ins.schema_create()[1]
-    data_ideal = ideal_ins.schema_create()[1]
-
-    # Adds the data to each table created
-    with Session(engine) as sess:
-        sess.add_all(my_test_class(**rec) for rec in data_test)
-        sess.add_all(my_train_class(**rec) for rec in data_train)
-        sess.add_all(my_ideal_class(**rec) for rec in data_ideal)
-        sess.commit()
-
-    # Creates dataframes for further analysis
-    test = df_create('Test')
-    train = df_create('Train')
-    ideal = df_create('Ideal')
+    if len(data_to_load) >= BULK_LOAD_MIN_ROWS:
+        table_ins.bulk_insert(engine, table_class.__table__, data_to_load)
+    else:
+        with Session(engine) as sess:
+            sess.add_all(table_class(**rec) for rec in data_to_load)
+            sess.commit()
 
-    # Generates ideal functions based on initial mapping of train to ideal, followed by test to ideal.
-    test_fns = TestFunctionReturner(train_df=train, ideal_df=ideal, test_df=test, sq_root_number=2)
 
-    # Creates dictionary of mapped test data for loading in sqlalchemy.
-    mapped_d = test_fns.mapped_fns_dict()
-
-    # Instantiates SQL lite table object
-    mapped_ins = etl_sql.SQLTableBuilder(mapped_d)
+def persist_table(data_to_load):
+    """
+    Creates the SQL lite table for the data and loads the data to it.
+    Input:
+        data_to_load (list) - dictionaries of data, as created by TableConverter.table_to_dict().
+    Output:
+        None - table is created and loaded.
+    """
+    # Instantiates the SQL lite table object
+    table_ins = etl_sql.SQLTableBuilder(data_to_load)
 
-    # Retrieves the SQL lite metadata
-    my_mapped_class = type(mapped_ins.schema_create()[0]['clsname'], (Base,), mapped_ins.schema_create()[0])
+    # Retrieves the SQL lite metadata and the data to load
+    class_dict, data = table_ins.schema_create()
+    table_class = type(class_dict['clsname'], (Base,), class_dict)
 
-    # Creates schemas
+    # Replaces any existing table, then creates schemas and adds the data to the table created
+    table_class.__table__.drop(engine, checkfirst=True)
     Base.metadata.create_all(engine)
-    data_mapped = mapped_ins.schema_create()[1]
+    load_table(table_ins, table_class, data)
 
-    # Adds the data to each table created
-    with Session(engine) as sess:
-        sess.add_all(my_mapped_class(**rec) for rec in data_mapped)
-        sess.commit()
 
-    # Creates main folder to save graphs
-    create_graph_folder()
+def persist_source(converter, columns=None, registry=None):
+    """
+    Creates and loads the SQL lite table for the csv read by converter.
+    Input:
+        converter (TableConverter) - table converter for the csv.
+        columns (dict) - optional output of converter.table_to_columns(), otherwise the csv is read.
+        registry (SourceRegistry) - optional, records the csv's content hash once loaded.
+    Output:
+        None - table is created and loaded.
+    """
+    if columns is None:
+        persist_table(converter.table_to_dict())
+    else:
+        persist_table(converter.columns_to_dict(columns))
+    if registry:
+        registry.record(next(iter(converter.dict_file)).title())
 
-    # Saves only mapped points in range of ideal function
-    IdealPlotter(train_df=train, ideal_df=ideal, sq_root_number=2, test_df=test).mapped_plotted_fns()
 
-    # Specifying .mapped_plotted_fns(True) saves unmapped points in range of ideal function
-    IdealPlotter(train_df=train, ideal_df=ideal, sq_root_number=2, test_df=test).mapped_plotted_fns(True)
+def set_database(db_path):
+    """
+    Points the engine at a persistent SQLite database file instead of the in-memory database.
+    Input:
+        db_path (str) - path of the database file, created if it does not exist.
+    Output:
+        None - module engine is replaced.
+    """
+    global engine
+    engine = create_engine("sqlite:///" + db_path, echo=True, connect_args={'check_same_thread': False})
 
-    # Generates summary graphs at inputted square roots (2 - 10, with increments of 1)
-    SummaryReporter(2, 10, 1, train, ideal, test).summary_graphs()
 
-    # Generates data for unmapped functions at square root of 6 analysis
-    unmapped_analysis = UnmappedClusters(train_df=train, ideal_df=ideal, test_df=test)
+# Creates dataframe for data loaded by sqlalchemy within the main namespace
+def df_create(table_name, columns=None, y_dtype=np.float64):
+    """
+    Creates a float dataframe from sqlite db, with 'x' as the index. Rows are read in order of x,
+    through the table's x index, a chunk at a time.
+    Input:
+        table_name (str) - name of table
+        columns (list) - optional column names to read, defaults to all columns.
+        y_dtype (dtype) - dtype of the data columns, default is float64.
+    Output:
+        dataframe sorted on index.
+    """
+    return etl_sql.SQLTableReader(engine, table_name).read_frame(columns, y_dtype)
 
-    # Prints Euclidean distances for clusters of unmapped points at upper and lower boundary set
-    # at square root of 6
-    unmapped_analysis.print_euclidean_dist()
 
-    # Displays original unmapped clusters
-    unmapped_analysis.original_cluster_display()
+def main():
+    # Initiate logfile
+    logging.basicConfig(filename="logfile.log", level=logging.INFO)
+    start = time.time()
+    logging.info('---Started---')
 
-    # Shows polynomial line fitted to clusters
-    unmapped_analysis.polynomial_display()
+    # Gets the input arguments
+    options = input_args_files.get_input_options()
+    _input = options.dir
+
+    # Optionally writes the stage metrics to their own file, and traces peak memory per stage
+    if options.metrics:
+        instrument.log_to_file(options.metrics)
+    if options.trace_memory:
+        tracemalloc.start()
+
+    with stage('main'):
+        with stage('input_files'):
+            # Checks that a valid input has been received
+            input_args_files.valid_path_inputted(_input)
+
+            # Checks all the files are in inputted folder
+            input_args_files.file_counter(_input)
+
+            # Creates dictionary mapping file path to test, train and ideal
+            files_folder = input_args_files.get_file_names(_input)
+
+            # Checks that above dictionary was created
+            _ = isinstance(files_folder, dict)
+
+            # Stores the file names and paths in variables
+            test, train, ideal = files_folder['test'], files_folder['train'], files_folder['ideal']
+
+        # Creates the table converters for each of test, train and ideal
+        # Parsed csv columns are memory-mapped from the parse cache while the csv files are unchanged
+        parse_cache = None if options.no_parse_cache else ParseCache(options.parse_cache)
+        converters = [etl_table.TableConverter(test, parse_cache), etl_table.TableConverter(train, parse_cache),
+                      etl_table.TableConverter(ideal, parse_cache)]
+        table_names = ['Test', 'Train', 'Ideal']
+
+        # In a persistent database, only tables whose csv changed since they were last loaded are reloaded
+        registry = None
+        stale = set(table_names)
+        if options.db:
+            with stage('source_hash_check'):
+                set_database(options.db)
+                registry = etl_sql.SourceRegistry(engine)
+                stale = {table_name for table_name, converter in zip(table_names, converters)
+                         if not registry.is_current(table_name, next(iter(converter.dict_file.values())))}
+                logging.info(('Tables reloaded from csv:', sorted(stale)))
+
+        # Precision of the y data held for the analysis, x is always float64
+        y_dtype = np.float32 if options.float32 else np.float64
+
+        sink, sink_jobs = None, []
+        if options.in_memory:
+            # Creates dataframes for further analysis directly from the csv columns
+            with stage('csv_parse') as record:
+                columns = [converter.table_to_columns(y_dtype=y_dtype) for converter in converters]
+                test, train, ideal = (df_from_columns(table_columns) for table_columns in columns)
+                record.rows = test.shape[0] + train.shape[0] + ideal.shape[0]
+
+            # Writes the tables to SQLite in the background, so the analysis does not wait on the database.
+            # In float32 mode the csv is re-read at full precision, rather than storing the rounded columns.
+            if options.float32:
+                columns = [None] * len(converters)
+            sink = ThreadPoolExecutor(max_workers=1)
+            sink_jobs = [sink.submit(persist_source, converter, table_columns, registry)
+                         for table_name, converter, table_columns in zip(table_names, converters, columns)
+                         if table_name in stale]
+        else:
+            # Creates the dataset dictionaries for each of test, train and ideal, then loads them to SQL lite
+            for table_name, converter in zip(table_names, converters):
+                if table_name in stale:
+                    with stage('load_table_' + table_name):
+                        persist_source(converter, registry=registry)
+
+            # Creates dataframes for further analysis
+            with stage('df_create') as record:
+                test = df_create('Test', y_dtype=y_dtype)
+                train = df_create('Train', y_dtype=y_dtype)
+                ideal = df_create('Ideal', y_dtype=y_dtype)
+                record.rows = test.shape[0] + train.shape[0] + ideal.shape[0]
+
+        # Shares the dataframes and calculated mapping between all reporting components
+        context = PipelineContext(train_df=train, ideal_df=ideal, test_df=test)
+
+        # Generates ideal functions based on initial mapping of train to ideal, followed by test to ideal.
+        test_fns = context.returner(TestFunctionReturner, 2)
+
+        # Reports the memory saved in float32 mode, and checks the rounding cannot change the ideal functions.
+        # The check reuses the context's sums of squares, rather than calculating them again
+        if options.float32:
+            with stage('float32_check'):
+                logging.info(('float32 mode bytes saved:',
+                              float32_bytes_saved([test, train, ideal] + test_fns.mapped_fns())))
+                precision_check = test_fns.selection_precision_check()
+                unchecked = [column for column, unchanged in precision_check.items() if not unchanged]
+                if unchecked:
+                    logging.warning(('float32 rounding may change the ideal function selected for:', unchecked))
+
+        # Creates dictionary of mapped test data for loading in sqlalchemy.
+        mapped_d = test_fns.mapped_fns_dict()
+
+        # Loads the mapped test data to SQL lite
+        if sink:
+            sink_jobs.append(sink.submit(persist_table, mapped_d))
+        else:
+            with stage('load_table_Mapped', rows=len(mapped_d)):
+                persist_table(mapped_d)
+
+        # Collects all graphs into one document if a dashboard file was requested, else creates main folder
+        dashboard = Dashboard() if options.dashboard else None
+        if dashboard is None:
+            create_graph_folder()
+
+        # Saves only mapped points in range of ideal function
+        context.returner(IdealPlotter, 2).mapped_plotted_fns(processes=options.processes, dashboard=dashboard)
+
+        # Specifying .mapped_plotted_fns(True) saves unmapped points in range of ideal function
+        context.returner(IdealPlotter, 2).mapped_plotted_fns(True, processes=options.processes,
+                                                           dashboard=dashboard)
+
+        # Generates summary graphs at inputted square roots (2 - 10, with increments of 1)
+        SummaryReporter(2, 10, 1, processes=options.processes, context=context).summary_graphs(dashboard)
+
+        # Generates data for unmapped functions at square root of 6 analysis
+        unmapped_analysis = context.returner(UnmappedClusters, 6)
+
+        # Prints Euclidean distances for clusters of unmapped points at upper and lower boundary set
+        # at square root of 6
+        unmapped_analysis.print_euclidean_dist()
+
+        # Displays original unmapped clusters
+        unmapped_analysis.original_cluster_display(dashboard)
+
+        # Shows polynomial line fitted to clusters
+        unmapped_analysis.polynomial_display(dashboard)
+
+        # Saves the dashboard, with the Bokeh resources inlined once for all graphs
+        if dashboard is not None:
+            with stage('dashboard_save', rows=len(dashboard.panels)):
+                dashboard.save(options.dashboard)
+
+        # Waits for the background SQLite sink to finish, raising any error it met
+        if sink:
+            with stage('sqlite_sink_wait'):
+                for job in sink_jobs:
+                    job.result()
+                sink.shutdown()
+            logging.info('SQLite sink finished')
+
+    # Reports how often the shared mapping results were reused
+    logging.info(('Pipeline context results:', context.result_cache.info()))
 
     # Concludes writing to logfile
     time_to_run = time.time() - start
@@ -0,0 +1,142 @@
+# parse_cache.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module caches the parsed, validated columns of each input csv as a binary NumPy file.
+# Each table is stored column by column in one .npy file, with a JSON manifest of the column names and
+# the csv's path, size, modification time and content hash. Later runs memory-map the .npy file instead
+# of parsing the csv again, so only the pages actually used are read from disk.
+# The cache is used while the csv's size and modification time are unchanged; if only the modification
+# time changed, the content hash decides.
+
+
+# Library imports
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Imports own module
+from etl_sql import file_content_hash
+
+# Version of the cache file layout, cached files of another version are re-parsed
+CACHE_FORMAT = 1
+
+
+class ParseCache:
+    """
+    Memory-mapped binary cache of parsed csv columns.
+    Input:
+        cache_dir (str) - folder holding the cached tables, created if it does not exist.
+    Output:
+        Dictionaries of {renamed column name : float64 array}, see columns.
+    """
+    # Initiates new constructor
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, file_path):
+        """
+        Returns the manifest and data file paths of a csv's cache entry, named after the csv's absolute path.
+        """
+        key = hashlib.blake2b(os.path.abspath(file_path).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, key + '.json'), os.path.join(self.cache_dir, key + '.npy')
+
+    def _is_current(self, manifest, file_path, file_stat):
+        """
+        Checks a manifest still describes the csv, only hashing the csv if its modification time changed.
+        """
+        if manifest.get('format') != CACHE_FORMAT or manifest.get('path') != os.path.abspath(file_path):
+            return False
+        if manifest['size'] != file_stat.st_size:
+            return False
+        if manifest['mtime_ns'] == file_stat.st_mtime_ns:
+            return True
+        return manifest['content_hash'] == file_content_hash(file_path)
+
+    def columns(self, file_path, parse):
+        """
+        Returns the csv's columns from the cache, or parses the csv and caches the columns.
+        Input:
+            file_path (str) - path of the csv.
+            parse (function) - called without arguments on a cache miss, returning a dictionary of
+            {renamed column name : float64 array}.
+        Output:
+            columns (dict) - maps renamed column name to a read-only memory-mapped float64 array.
+        """
+        manifest_path, data_path = self._paths(file_path)
+        file_stat = os.stat(file_path)
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if self._is_current(manifest, file_path, file_stat):
+                columns = self._map(data_path, manifest['columns'], manifest['rows'])
+                if manifest['mtime_ns'] != file_stat.st_mtime_ns:
+                    manifest['mtime_ns'] = file_stat.st_mtime_ns
+                    self._write_manifest(manifest_path, manifest)
+                return columns
+        except (OSError, ValueError, KeyError):
+            # Missing, unreadable or mismatched cache entry, re-parsed below
+            pass
+
+        # Hashes the csv before parsing it, so a csv changed while being parsed is re-parsed by the next run
+        content_hash = file_content_hash(file_path)
+        columns = parse()
+        if not columns:
+            return columns
+        col_names = list(columns.keys())
+        # Writes the data before the manifest, each through a uniquely named temporary file, so a partly
+        # written entry is never used and processes parsing the same csv do not overwrite each other's files
+        n_rows = len(columns[col_names[0]])
+        data_tmp = self._temp_path('.npy')
+        try:
+            data = np.lib.format.open_memmap(data_tmp, mode='w+', dtype=np.float64, shape=(len(col_names), n_rows))
+            for col_num, col_name in enumerate(col_names):
+                data[col_num] = columns[col_name]
+            data.flush()
+            del data
+            os.replace(data_tmp, data_path)
+        finally:
+            if os.path.exists(data_tmp):
+                os.remove(data_tmp)
+        self._write_manifest(manifest_path, {'format': CACHE_FORMAT,
+                                             'path': os.path.abspath(file_path),
+                                             'size': file_stat.st_size,
+                                             'mtime_ns': file_stat.st_mtime_ns,
+                                             'content_hash': content_hash,
+                                             'columns': col_names,
+                                             'rows': n_rows})
+        return self._map(data_path, col_names, n_rows)
+
+    def _temp_path(self, suffix):
+        """
+        Creates a uniquely named empty temporary file in the cache folder, returning its path.
+        """
+        file_handle, temp_path = tempfile.mkstemp(suffix=suffix + '.tmp', dir=self.cache_dir)
+        os.close(file_handle)
+        return temp_path
+
+    def _write_manifest(self, manifest_path, manifest):
+        """
+        Writes a manifest through a uniquely named temporary file.
+        """
+        manifest_tmp = self._temp_path('.json')
+        try:
+            with open(manifest_tmp, 'w') as manifest_file:
+                json.dump(manifest, manifest_file)
+            os.replace(manifest_tmp, manifest_path)
+        finally:
+            if os.path.exists(manifest_tmp):
+                os.remove(manifest_tmp)
+
+    def _map(self, data_path, col_names, n_rows):
+        """
+        Memory-maps a cached table, returning one contiguous read-only array per column.
+        Raises ValueError if the data file does not hold the manifest's columns and rows.
+        """
+        data = np.load(data_path, mmap_mode='r')
+        if data.shape != (len(col_names), n_rows):
+            raise ValueError('Cached data shape ' + str(data.shape) + ' does not match its manifest')
+        return {col_name: data[col_num] for col_num, col_name in enumerate(col_names)}
@@ -0,0 +1,63 @@
+# pipeline.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module holds the train, ideal and test dataframes of one program run, shared by all
+# reporting components (IdealPlotter, SummaryReporter, UnmappedClusters).
+# Components created from the context store their memoized results in the context's own result cache.
+# The train to ideal selection is therefore calculated once per run, and the bounds and mapped/unmapped
+# sets once per square root. Each dataframe is fingerprinted once by the context rather than on every
+# call, so a dataframe assigned to the context later gets its own results.
+
+
+# Imports own modules
+from result_cache import ResultCache
+from result_cache import frame_fingerprint
+
+
+class PipelineContext:
+    """
+    Shared dataframes and results of one program run.
+    The dataframes are treated as read-only once the context is created.
+    Input:
+        train_df, ideal_df, test_df (dataframes) - created after being loaded by sqlalchemy.
+    Output:
+        Components sharing result_cache, see returner.
+    """
+    # Initiates new constructor
+    def __init__(self, train_df, ideal_df, test_df):
+        self.train_df = train_df
+        self.ideal_df = ideal_df
+        self.test_df = test_df
+        self.result_cache = ResultCache()
+        # Fingerprints by id of the dataframe -> (dataframe, fingerprint)
+        self._fingerprints = dict()
+
+    def fingerprint(self, df):
+        """
+        Returns the fingerprint of a dataframe, calculated on first use. The dataframe is kept with its
+        fingerprint, so its id cannot be reused by another dataframe while the context exists.
+        Input:
+            df (dataframe) - one of the context's dataframes, or a dataframe assigned in its place.
+        Output:
+            fingerprint (str) - see result_cache.frame_fingerprint.
+        """
+        entry = self._fingerprints.get(id(df))
+        if entry is None or entry[0] is not df:
+            entry = (df, frame_fingerprint(df))
+            self._fingerprints[id(df)] = entry
+        return entry[1]
+
+    def returner(self, cls, sq_root_number, **kwargs):
+        """
+        Creates a TestFunctionReturner (or subclass) object on the context's dataframes and results.
+        Input:
+            cls (class) - TestFunctionReturner or a subclass taking (train_df, ideal_df, test_df,
+            sq_root_number), e.g. IdealPlotter or UnmappedClusters.
+            sq_root_number (int) - square root of the object.
+            kwargs - further keyword arguments of cls, e.g. the DB-Scan parameters of UnmappedClusters.
+        Output:
+            obj - object of cls attached to the context.
+        """
+        obj = cls(self.train_df, self.ideal_df, self.test_df, sq_root_number, **kwargs)
+        obj.context = self
+        return obj
@@ -0,0 +1,75 @@
+# polyfit.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module fits polynomial lines by least squares, directly on Vandermonde matrices.
+# Every (degree, group) combination is solved in one batched pseudo-inverse, and the best degree per
+# group is chosen by normalised RMSE. Used for the polynomial line of the unmapped cluster centroids.
+
+
+# Library imports
+import numpy as np
+
+# Imports own module
+from arithmetic import norm_root_mean_squared_error
+
+
+def vandermonde(x, degree):
+    """
+    Creates the Vandermonde matrix of x, with columns x^0, x^1, ..., x^degree.
+    Input:
+        x (array) - x values.
+        degree (int) - polynomial degree.
+    Output:
+        matrix (array) - 2d array (len(x) x degree + 1).
+    """
+    return np.asarray(x, dtype=np.float64)[:, np.newaxis] ** np.arange(degree + 1)
+
+
+def fit_polynomials(x_groups, y_groups, degrees=(3,), grid_points=None):
+    """
+    Fits a polynomial of each degree to each group of points, then keeps the degree with the lowest
+    normalised RMSE per group. Groups may have different numbers of points.
+    Input:
+        x_groups, y_groups (lists of arrays) - x and y values of each group.
+        degrees (tuple) - polynomial degrees to try, default is 3 only.
+        grid_points (int) - default None evaluates the fitted curve on the group's sorted x values,
+        else on this many evenly spaced x values between the group's minimum and maximum x.
+    Output:
+        fits (list) - one dictionary per group, of degree, coefficients (lowest power first),
+        norm_rmse, and grid_x, grid_y (the fitted curve evaluated on the sorted grid).
+    """
+    degrees = list(degrees)
+    max_degree = max(degrees)
+    n_groups = len(x_groups)
+    n_max = max((len(x) for x in x_groups), default=0)
+
+    # Stacks one zero-padded Vandermonde system per (degree, group), unused columns and rows are zero
+    systems = np.zeros((len(degrees), n_groups, n_max, max_degree + 1))
+    targets = np.zeros((n_groups, n_max))
+    for group, (x, y) in enumerate(zip(x_groups, y_groups)):
+        targets[group, :len(y)] = y
+        for pos, degree in enumerate(degrees):
+            systems[pos, group, :len(x), :degree + 1] = vandermonde(x, degree)
+
+    # Solves all systems at once, the pseudo-inverse gives the minimum norm least squares solution
+    coefs = np.einsum('dgkn,gn->dgk', np.linalg.pinv(systems), targets)
+
+    fits = []
+    for group, (x, y) in enumerate(zip(x_groups, y_groups)):
+        x = np.asarray(x, dtype=np.float64)
+        # Normalised RMSE of each degree, missing values (e.g. a flat y) are never preferred
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n_rmse = np.array([norm_root_mean_squared_error(y, vandermonde(x, degree) @ coefs[pos, group, :degree + 1])
+                               for pos, degree in enumerate(degrees)], dtype=np.float64)
+        best = int(np.argmin(np.where(np.isnan(n_rmse), np.inf, n_rmse)))
+        degree = degrees[best]
+        if grid_points is None:
+            grid_x = np.sort(x, kind='stable')
+        else:
+            grid_x = np.linspace(x.min(), x.max(), grid_points)
+        fits.append({'degree': degree,
+                     'coefficients': coefs[best, group, :degree + 1],
+                     'norm_rmse': n_rmse[best],
+                     'grid_x': grid_x,
+                     'grid_y': vandermonde(grid_x, degree) @ coefs[best, group, :degree + 1]})
+    return fits
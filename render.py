@@ -0,0 +1,29 @@
+# render.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module schedules the rendering of Bokeh graphs.
+# Graphs are first described by picklable figure specs (plain data, titles and file names). The
+# figures are then built, serialized to HTML and saved by a render function - on a process pool when
+# more than one process is requested, as HTML serialization of large figures is CPU-bound.
+
+
+# Library imports
+from multiprocessing import Pool
+
+
+def render_figures(render_func, specs, processes=1):
+    """
+    Calls render_func for each figure spec, optionally on a process pool.
+    Input:
+        render_func (function) - module level function building and saving the graph for one spec.
+        specs (list) - picklable figure specs.
+        processes (int) - default is 1 (render in this process), else the number of worker processes.
+    Output:
+        None - graphs are saved by render_func.
+    """
+    if processes > 1 and len(specs) > 1:
+        with Pool(min(processes, len(specs))) as pool:
+            pool.map(render_func, specs)
+    else:
+        for spec in specs:
+            render_func(spec)
@@ -0,0 +1,164 @@
+# result_cache.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module memoizes the derived results of TrainFunctionReturner and its subclasses.
+# Each object keeps its own result cache, or shares its PipelineContext's (pipeline module), so results
+# live only as long as the object or program run they belong to. Results are keyed on a content
+# fingerprint of the input dataframes and the square root, so that repeated calls reuse the mapping
+# instead of recalculating it. Changing the square root, or the dataframes, changes the key and so
+# recalculates.
+# Callers receive copies of the stored results (lazy copy-on-write copies for dataframes with
+# pandas >= 3.0, read-only views for arrays), so modifying a result never changes later calls.
+
+
+# Library imports
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Fingerprints of the dataframes used by the memoized call in progress, per thread, see memoized
+_call_state = threading.local()
+
+# pandas >= 3.0 always copies on write, so a shallow copy of a stored dataframe is safe to modify
+_COPY_ON_WRITE = int(pd.__version__.split('.')[0]) >= 3
+
+
+def frame_fingerprint(df):
+    """
+    Creates a fingerprint of a dataframe's shape, column names, dtypes, index and values.
+    Input:
+        df (dataframe) - dataframe to fingerprint.
+    Output:
+        fingerprint (str) - hex digest of the dataframe.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((df.shape, list(df.columns), [str(dtype) for dtype in df.dtypes], df.index.name)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def copy_result(result):
+    """
+    Returns a copy of a stored result which can be modified without changing the stored result.
+    Input:
+        result - dataframe, series, array, or a dict, list or tuple of these (other values are returned as is).
+    Output:
+        copied result - dataframes and series are copied, arrays are returned as read-only views.
+    """
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.copy(deep=not _COPY_ON_WRITE)
+    if isinstance(result, np.ndarray):
+        view = result.view()
+        view.flags.writeable = False
+        return view
+    if isinstance(result, dict):
+        return {key: copy_result(value) for key, value in result.items()}
+    if isinstance(result, (list, tuple)):
+        return type(result)(copy_result(value) for value in result)
+    return result
+
+
+class ResultCache:
+    """
+    Least recently used store of calculated results, with hit and miss counters.
+    Results are returned as copies, see copy_result.
+    Input:
+        max_size (int) - number of results kept before the least recently used is dropped.
+    """
+    # Initiates new constructor
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def get_or_calculate(self, key, calculate):
+        """
+        Returns the result stored under key, otherwise calculates and stores it.
+        Input:
+            key (tuple) - hashable key of the result.
+            calculate (function) - called without arguments to create a missing result.
+        Output:
+            result stored for key.
+        """
+        if key in self._results:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return copy_result(self._results[key])
+        self.misses += 1
+        result = calculate()
+        self._results[key] = result
+        if len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+        return copy_result(result)
+
+    def info(self):
+        """
+        Reports the hit and miss counters and the number of results stored.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._results)}
+
+    def clear(self):
+        """
+        Removes all stored results and resets the counters.
+        """
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def _call_fingerprint(df):
+    """
+    Returns the fingerprint of a dataframe, calculated once per outermost memoized call. Memoized
+    methods calling each other therefore fingerprint each dataframe once, while later calls see any
+    change made to the dataframe in between.
+    """
+    entry = _call_state.fingerprints.get(id(df))
+    # The dataframe is kept in the entry, so its id cannot be reused during the call
+    if entry is None or entry[0] is not df:
+        entry = (df, frame_fingerprint(df))
+        _call_state.fingerprints[id(df)] = entry
+    return entry[1]
+
+
+def memoized(*frame_names, uses_sq_root=True, attributes=()):
+    """
+    Decorator memoizing a method without arguments in the object's own result_cache.
+    Objects attached to a PipelineContext (pipeline module) use the context's result cache instead,
+    with the dataframes fingerprinted once by the context, as its dataframes are treated as read-only.
+    Otherwise the dataframes are fingerprinted by content on each (outermost) call, so assigning a
+    different dataframe, or modifying one in place, recalculates.
+    Input:
+        frame_names (str) - names of the dataframe attributes the result depends on.
+        uses_sq_root (boolean) - default is True, if False the square root is left out of the key.
+        attributes (tuple) - names of further attributes the result depends on, added to the key.
+    Output:
+        decorated method - results are reused by later calls on the object (or context).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self):
+            outermost = getattr(_call_state, 'fingerprints', None) is None
+            if outermost:
+                _call_state.fingerprints = dict()
+            try:
+                key = [method.__qualname__]
+                if self.context is None:
+                    cache = self.result_cache
+                    key.extend(_call_fingerprint(getattr(self, name)) for name in frame_names)
+                else:
+                    cache = self.context.result_cache
+                    key.extend(self.context.fingerprint(getattr(self, name)) for name in frame_names)
+                if uses_sq_root:
+                    key.append(repr(self.sq_root_number))
+                key.extend(repr(getattr(self, name)) for name in attributes)
+                return cache.get_or_calculate(tuple(key), lambda: method(self))
+            finally:
+                if outermost:
+                    _call_state.fingerprints = None
+        return wrapper
+    return decorator
@@ -0,0 +1,93 @@
+# shared_frames.py
+# -*- coding: utf-8 -*-
+
+# PURPOSE:    This module places numeric dataframes (train, ideal and test) in shared memory, so that
+# worker processes can rebuild them without the dataframes being pickled to every worker.
+# Each dataframe is stored as one block: the float64 index, followed by the values in the dataframe's
+# float dtype (so float32 dataframes stay float32).
+
+
+# Library imports
+import threading
+
+import numpy as np
+import pandas as pd
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+# Serialises attaching blocks while resource tracker registration is switched off (Python < 3.13)
+_attach_lock = threading.Lock()
+
+
+class SharedFrame:
+    """
+    Copies a numeric dataframe into a shared memory block.
+    The small, picklable spec attribute is passed to worker processes, which call attach_frame to
+    rebuild the dataframe on top of the shared block.
+    Input:
+        df (dataframe) - dataframe with numeric index and columns.
+    Output:
+        spec (tuple) - shared memory name, values shape and dtype, column names and index name.
+    """
+    # Initiates new constructor
+    def __init__(self, df):
+        dtype = np.dtype(np.float32 if df.shape[1] and (df.dtypes == np.float32).all() else np.float64)
+        n_rows = df.shape[0]
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, n_rows * 8 + df.size * dtype.itemsize))
+        # Index is stored first, followed by the dataframe's values
+        index, values = _block_arrays(self.shm, n_rows, df.shape, dtype)
+        index[:] = df.index.to_numpy(dtype=np.float64)
+        values[:] = df.to_numpy(dtype=dtype)
+        self.spec = (self.shm.name, df.shape, dtype.str, list(df.columns), df.index.name)
+
+    def close(self):
+        """
+        Releases and removes the shared memory block, once all workers have finished.
+        """
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _block_arrays(shm, n_rows, shape, dtype):
+    """
+    Returns the index and values arrays laid out in a shared memory block.
+    """
+    index = np.ndarray((n_rows,), dtype=np.float64, buffer=shm.buf)
+    values = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=n_rows * 8)
+    return index, values
+
+
+def _attach_block(name):
+    """
+    Attaches an existing shared memory block without registering it with the resource tracker, so that
+    only the SharedFrame which created the block unlinks it.
+    Before Python 3.13 (no track argument) attaching always registers the block. Unregistering it again
+    afterwards would also drop the creator's registration in the tracker shared with the workers, so
+    registration is skipped while attaching instead.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        with _attach_lock:
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+
+def attach_frame(spec):
+    """
+    Rebuilds a dataframe from the spec of a SharedFrame, without copying the values.
+    Input:
+        spec (tuple) - SharedFrame.spec
+    Output:
+        shm (SharedMemory) - attached block, must be kept for as long as the dataframe is used.
+        df (dataframe) - dataframe whose values are a view of the shared block.
+    """
+    name, shape, dtype, columns, index_name = spec
+    shm = _attach_block(name)
+    index, values = _block_arrays(shm, shape[0], shape, np.dtype(dtype))
+    df = pd.DataFrame(values, index=pd.Index(index, name=index_name), columns=columns, copy=False)
+    return shm, df
@@ -10,6 +10,8 @@
 # Library imports
 import pandas as pd
 from os import getcwd
+from os.path import basename
+from multiprocessing import Pool
 
 from bokeh.models import ColumnDataSource
 from bokeh.plotting import figure
@@ -21,6 +23,11 @@ from bokeh.palettes import Spectral11
 # Imports own modules
 from test import TestFunctionReturner
 from graphing import create_graph_folder
+from instrument import instrumented
+from shared_frames import SharedFrame
+from shared_frames import attach_frame
+from pipeline import PipelineContext
+from render import render_figures
 
 # Creates additional folder to save graphs
 create_graph_folder('additional_graphs')
@@ -44,21 +51,86 @@ class _SummaryReportFetch(TestFunctionReturner):
         self.sq_root_number = new_sqrt
 
 
+# Shared memory blocks and dataframes attached by each sweep worker process, and the worker's context
+_worker_frames = []
+_worker_context = []
+
+
+def _init_sweep_worker(specs):
+    """
+    Attaches the train, ideal and test dataframes from shared memory, once per worker process.
+    The worker's square roots share one PipelineContext, so the ideal function selection is calculated
+    once per worker.
+    """
+    _worker_frames[:] = [attach_frame(spec) for spec in specs]
+    _worker_context[:] = [PipelineContext(*(df for _, df in _worker_frames))]
+
+
+def _summary_for_sq_root(sq_root, train, ideal, test, context=None):
+    """
+    Retrieves the summary report for a single square root, from the pipeline context's results if given.
+    """
+    # Creates supporting class object
+    if context is None:
+        class_obj = _SummaryReportFetch(train, ideal, test, 1)
+    else:
+        class_obj = context.returner(_SummaryReportFetch, 1)
+    class_obj.new_sq_root_number(sq_root)
+    return class_obj.summary_results_df()
+
+
+def _sweep_worker(sq_root):
+    """
+    Retrieves the summary report for a single square root, using the worker's shared dataframes.
+    """
+    train, ideal, test = (df for _, df in _worker_frames)
+    return _summary_for_sq_root(sq_root, train, ideal, test, _worker_context[0])
+
+
 class SummaryReporter:
     """
     Repeatedly calls summary results df with different square roots, then concatenates these for input
     to Bokeh.
     Calls Bokeh library with summarised data for graph generation.
+    If processes is greater than 1, the square roots are run on a process pool, with the train, ideal
+    and test dataframes shared with the workers through shared memory, and the graphs are rendered on
+    a process pool.
+    If a PipelineContext is given, its dataframes are used and the serial sweep shares its results,
+    otherwise the reporter creates its own context.
     """
     # Initiates new constructor
-    def __init__(self, start, stop, step, train, ideal, test):
+    def __init__(self, start, stop, step, train=None, ideal=None, test=None, processes=1, context=None):
+        if context is None:
+            context = PipelineContext(train_df=train, ideal_df=ideal, test_df=test)
+        train, ideal, test = context.train_df, context.ideal_df, context.test_df
         self.start = start
         self.stop = stop
         self.step = step
         self.train = train
         self.ideal = ideal
         self.test = test
+        self.processes = processes
+        self.context = context
 
+    def _parallel_summary(self, sq_roots):
+        """
+        Runs the summary results df for each square root on a process pool.
+        Inputs:
+            sq_roots (list) - square roots to run.
+        Outputs:
+            my_list (list) - summary reports, in the same order as sq_roots.
+        """
+        shared = [SharedFrame(df) for df in (self.train, self.ideal, self.test)]
+        try:
+            with Pool(min(self.processes, len(sq_roots)), initializer=_init_sweep_worker,
+                      initargs=([frame.spec for frame in shared],)) as pool:
+                my_list = pool.map(_sweep_worker, sq_roots)
+        finally:
+            for frame in shared:
+                frame.close()
+        return my_list
+
+    @instrumented
     def summary(self):
         """
         Repeatedly calls the summary results df with different square roots, concatenates and returns
@@ -68,63 +140,99 @@ class SummaryReporter:
         Outputs:
             DataFrame of square root, percentage mapped in area and percentage mapped in total.
         """
-        my_list = []
         # Creates range object iterator
-        for i in range(self.start, self.stop + 1, self.step):
-            # Creates supporting class object
-            class_obj = _SummaryReportFetch(self.train, self.ideal, self.test, 1)
-            class_obj.new_sq_root_number(i)
-
-            # Retrieves summary report for that square root
-            _df = class_obj.summary_results_df()
-
-            # Appends all summary reports together
-            my_list.append(_df)
+        sq_roots = list(range(self.start, self.stop + 1, self.step))
+        if self.processes > 1 and len(sq_roots) > 1:
+            my_list = self._parallel_summary(sq_roots)
+        else:
+            # Retrieves summary report for each square root
+            my_list = [_summary_for_sq_root(i, self.train, self.ideal, self.test, self.context) for i in sq_roots]
+        # Appends all summary reports together
         return pd.concat(my_list)
 
-    def summary_graphs(self):
+    def _figure_specs(self):
         """
-        Outputs Bokeh graph representations of each summary from above.
+        Creates the figure spec of each ideal function's summary graph, for rendering by
+        _render_summary_figure.
         Inputs:
             None - implicit continuation of the summary function above.
         Outputs:
-            Graph of square root and percentage mapped in area and percentage mapped in total.
+            specs (list) - one dictionary of graph data, title and file name per ideal function.
         """
         # Creates the summary dataframe
         _df = self.summary()
+        graphs_directory = getcwd() + '/additional_graphs/'
+        specs = []
         for idx in _df.index.unique():
             # Retrieves required columns for graphing
             df = _df.loc[_df.index == idx][['square_root', 'perc_mapped_in_area', 'perc_mapped_total']]
             sq_rt = [str(sq_rt) for sq_rt in df['square_root'].values]
 
-            # Creates title for graph
-            _title = idx.replace('_', ' ')
-
             # Inputs the graph data to a ColumnDataSource dictionary object
             data = {'sq_rt': sq_rt,
                     'perc_mapped_in_area': df['perc_mapped_in_area'].values,
                     'perc_mapped_total': df['perc_mapped_total'].values
                     }
-            source = ColumnDataSource(data=data)
-
-            # Instantiates figure for graphing
-            p = figure(x_range=sq_rt, y_range=(0, 1.1), width=1000, height=750,
-                       title=_title + ": percentage test points mapped by differing square roots",
-                       toolbar_location=None, x_axis_label='square root', y_axis_label='percentage mapped')
-            # Plots bars
-            p.vbar(x=dodge('sq_rt', -0.25, range=p.x_range), top='perc_mapped_in_area', width=0.2, source=source,
-                   color=Spectral11[1], legend_label="perc_mapped_in_area")
-            p.vbar(x=dodge('sq_rt', 0.25, range=p.x_range), top='perc_mapped_total', width=0.2, source=source,
-                   color=Spectral11[3], legend_label="perc_mapped_total")
-
-            # Graph formatting
-            p.title.text_font_size = "14px"
-            p.x_range.range_padding = 0.01
-            p.xgrid.grid_line_color = None
-            p.add_layout(p.legend[0], 'right')
-
-            # Graph filename
-            _filename = idx + '_summary.html'
-            graphs_directory = getcwd() + '/additional_graphs/'
-            output_file(graphs_directory + _filename)
-            save(p)
+            # Creates title and filename for graph
+            specs.append({'title': idx.replace('_', ' '), 'data': data,
+                          'filename': graphs_directory + idx + '_summary.html'})
+        return specs
+
+    @instrumented
+    def summary_graphs(self, dashboard=None):
+        """
+        Outputs Bokeh graph representations of each summary from above.
+        Graphs are serialized and saved on a process pool if processes is greater than 1.
+        Inputs:
+            dashboard (Dashboard) - optional, if given the graphs are added to it as tabs instead of
+            being saved as separate files.
+        Outputs:
+            Graph of square root and percentage mapped in area and percentage mapped in total.
+        """
+        specs = self._figure_specs()
+        if dashboard is None:
+            render_figures(_render_summary_figure, specs, self.processes)
+        else:
+            for spec in specs:
+                dashboard.add(basename(spec['filename']).replace('.html', ''), _build_summary_figure(spec))
+
+
+def _build_summary_figure(spec):
+    """
+    Builds the Bokeh summary graph of one ideal function from its spec (see SummaryReporter._figure_specs).
+    Inputs:
+        spec (dict) - graph data, title and file name.
+    Outputs:
+        p (figure) - Bokeh figure.
+    """
+    sq_rt = spec['data']['sq_rt']
+    source = ColumnDataSource(data=spec['data'])
+
+    # Instantiates figure for graphing
+    p = figure(x_range=sq_rt, y_range=(0, 1.1), width=1000, height=750,
+               title=spec['title'] + ": percentage test points mapped by differing square roots",
+               toolbar_location=None, x_axis_label='square root', y_axis_label='percentage mapped')
+    # Plots bars
+    p.vbar(x=dodge('sq_rt', -0.25, range=p.x_range), top='perc_mapped_in_area', width=0.2, source=source,
+           color=Spectral11[1], legend_label="perc_mapped_in_area")
+    p.vbar(x=dodge('sq_rt', 0.25, range=p.x_range), top='perc_mapped_total', width=0.2, source=source,
+           color=Spectral11[3], legend_label="perc_mapped_total")
+
+    # Graph formatting
+    p.title.text_font_size = "14px"
+    p.x_range.range_padding = 0.01
+    p.xgrid.grid_line_color = None
+    p.add_layout(p.legend[0], 'right')
+    return p
+
+
+def _render_summary_figure(spec):
+    """
+    Builds and saves the Bokeh summary graph of one ideal function as a standalone file.
+    Inputs:
+        spec (dict) - graph data, title and file name.
+    Outputs:
+        Saved Bokeh graph, no explicit return value.
+    """
+    output_file(spec['filename'])
+    save(_build_summary_figure(spec))
@@ -12,11 +12,15 @@
 
 
 # Library imports
+import numpy as np
 import pandas as pd
 
 # Imports own module
 from train import TrainFunctionReturner
 from arithmetic import calc_diff
+from arithmetic import calc_abs
+from result_cache import memoized
+from instrument import instrumented
 
 
 class TestFunctionReturner(TrainFunctionReturner):
@@ -35,56 +39,111 @@ class TestFunctionReturner(TrainFunctionReturner):
         # Assigns the test_df attribute
         self.test_df = test_df
 
-    def _mapped_fns(self):
+    def _match_positions(self, ideal_index, test_x):
+        """
+        Matches test x values to the ideal rows with equal x. An ideal x value may repeat, in which case
+        the test point is matched to each of its rows, in row order.
+        Input:
+            ideal_index (index) - x values of the ideal function's rows.
+            test_x (array) - x values of the test points.
+        Output:
+            test_pos, ideal_pos (arrays) - positions of each matching test point and ideal row, ordered
+            by test point.
+        """
+        if ideal_index.is_unique:
+            ideal_pos = ideal_index.get_indexer(test_x)
+            test_pos = np.flatnonzero(ideal_pos >= 0)
+            return test_pos, ideal_pos[test_pos]
+        # Repeated x values: finds each test point's run of equal x values in the stably sorted ideal x
+        ideal_x = ideal_index.to_numpy(dtype=np.float64)
+        test_x = np.asarray(test_x, dtype=np.float64)
+        order = np.argsort(ideal_x, kind='stable')
+        sorted_x = ideal_x[order]
+        starts = np.searchsorted(sorted_x, test_x, side='left')
+        counts = np.searchsorted(sorted_x, test_x, side='right') - starts
+        counts[np.isnan(test_x)] = 0
+        test_pos = np.repeat(np.arange(len(test_x)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return test_pos, order[np.repeat(starts, counts) + offsets]
+
+    @memoized('train_df', 'ideal_df', 'test_df')
+    def _mapped_fns_arrays(self):
         """
         Helper function that checks values in test_df to find if the deviation does not exceed the
         largest deviation between train and ideal (previously multiplied by square-root of 2 or
         the number inputted).
+        Test points are aligned to the ideal rows on x with a single indexed join per ideal function,
+        and the deviation threshold is applied as an array mask.
+        Input:
+            No explicit input, uses the implicitly created test_df input and inherited train_df.
+        Output:
+            output_dict (dict) - column arrays of the mapped x, y values of test_df with the delta
+            (difference), square root and name of the ideal function. Ordered by test point, then
+            ideal function.
+        """
+        mapped_fn_df = super().mapped_fns()
+        test_x = self.test_df.index.to_numpy()
+        test_y = self.test_df['y_test_func'].to_numpy(dtype=np.float64)
+
+        test_pos, fn_pos, delta, square_root, names = [], [], [], [], []
+        for fn_num, ideal_fn in enumerate(mapped_fn_df):
+            # Finds the ideal rows matching each test point's x co-ordinate
+            matched, ideal_pos = self._match_positions(ideal_fn.index, test_x)
+            # Calculates the difference or error and converts to absolute value
+            abs_diff = calc_diff(test_y[matched], ideal_fn['y_ideal'].to_numpy(dtype=np.float64)[ideal_pos])
+            abs_diff = calc_abs(abs_diff, out=abs_diff)
+            # Checks the value against the max deviation multiplied by square root
+            within = abs_diff <= ideal_fn['prod_max_dev_sq_root'].to_numpy()[ideal_pos]
+            test_pos.append(matched[within])
+            fn_pos.append(np.full(within.sum(), fn_num))
+            delta.append(abs_diff[within])
+            square_root.append(ideal_fn['square_root'].to_numpy()[ideal_pos][within])
+            names.append(ideal_fn['name'].to_numpy()[ideal_pos][within])
+
+        if not mapped_fn_df:
+            return {'x': test_x[:0], 'y_test_func': test_y[:0], 'delta_y_test_func': test_y[:0],
+                    'square_root': np.array([]), 'num_of_ideal_func': np.array([], dtype=object)}
+        test_pos = np.concatenate(test_pos)
+        # Orders the matches by test point, then by ideal function
+        order = np.lexsort((np.concatenate(fn_pos), test_pos))
+        test_pos = test_pos[order]
+        return {'x': test_x[test_pos],
+                'y_test_func': test_y[test_pos],
+                'delta_y_test_func': np.concatenate(delta)[order],
+                'square_root': np.concatenate(square_root)[order],
+                'num_of_ideal_func': np.concatenate(names)[order]}
+
+    def _mapped_fns(self):
+        """
+        Helper function returning the mapped points from _mapped_fns_arrays as tuples.
         Input:
             No explicit input, uses the implicitly created test_df input and inherited train_df.
         Output:
             output_list (list) - mapped x, y values of test_df with the delta (difference)
             and name of the ideal function.
         """
-        mapped_fn_df = super().mapped_fns()
-        _output_list = []
-
-        # Checks the deviation of points within test_df to see if they lie between the lower and
-        # upper bounds of the four ideal functions
-        for line in self.test_df.itertuples():
-            for ideal_fn in mapped_fn_df:
-                my_list = []
-                # Loops the points within test_df against ideal_df's functions, based on x
-                # co-ordinates (index) matching
-                for row in ideal_fn.itertuples():
-                    if line.Index == row.Index:
-                        # Calculates the difference or error and converts to absolute value
-                        diff = calc_diff(line.y_test_func, row.y_ideal)
-                        abs_diff = abs(diff)
-                        # Checks the value against the max deviation multiplied by square root
-                        if abs_diff <= row.prod_max_dev_sq_root:
-                            my_list.append([line.Index, line.y_test_func, abs_diff, row.square_root, row.name])
-                _output_list.append(my_list)
-        output_list = [tuple(values) for line in _output_list for values in line]
-        return output_list
+        return list(zip(*(values.tolist() for values in self._mapped_fns_arrays().values())))
 
+    @instrumented
+    @memoized('train_df', 'ideal_df', 'test_df')
     def mapped_fns_df(self):
         """
         Creates dataframe of mapped functions for test data.
         Input:
-            No explicit input, calls _mapped_fns function and creates further dataframe.
+            No explicit input, calls _mapped_fns_arrays function and creates further dataframe.
         Output:
             mapped_output_df (dataframe) - mapped x, y values of test_df with the delta (difference)
             and name of the ideal function.
         """
-        output_list = self._mapped_fns()
+        output_dict = self._mapped_fns_arrays()
         # Returns a Pandas dataframe with results
-        mapped_output_df = pd.DataFrame(output_list, columns=['x', 'y_test_func', 'delta_y_test_func',
+        mapped_output_df = pd.DataFrame(output_dict, columns=['x', 'y_test_func', 'delta_y_test_func',
                                                               'square_root', 'num_of_ideal_func'])
         mapped_output_df.set_index('x', inplace=True)
         mapped_output_df.sort_index(inplace=True)
         return mapped_output_df
 
+    @instrumented
     def mapped_fns_dict(self):
         """
         Creates dictionary of test data mapped to ideal function to be used as input to sqlalchemy.
@@ -107,15 +166,22 @@ class TestFunctionReturner(TrainFunctionReturner):
             dict_entries.update(x_val)
         return mapped_fns_dict
 
-    def _set_difference(self, df, mapped_points):
+    def _anti_join(self, mapped_points):
         """
-        Helper function using set difference methodology to find unmapped points
-        between function index and mapped points.
+        Helper function returning the test points whose x co-ordinate is not among mapped_points,
+        using a single hashed lookup of the test index rather than a search per point.
+        Input:
+            mapped_points (array) - x co-ordinates of mapped points.
+        Output:
+            _df (dataframe) - x, y values of the unmapped test points, in test_df order.
         """
-        idx = set(df.index.values)
-        dif = idx.difference(mapped_points)
-        return dif
+        test_x = self.test_df.index
+        unmapped = ~test_x.isin(mapped_points)
+        return pd.DataFrame({'x': test_x.to_numpy()[unmapped],
+                             'y_test_func': self.test_df['y_test_func'].to_numpy()[unmapped]})
 
+    @instrumented
+    @memoized('train_df', 'ideal_df', 'test_df')
     def unmapped_fns(self):
         """
         Creates dataframe of unmapped test function points, compared to each ideal function.
@@ -127,26 +193,26 @@ class TestFunctionReturner(TrainFunctionReturner):
             unmapped_output_df (dataframe) - unmapped functions for each ideal function
         """
         mapped_fns_df = self.mapped_fns_df()
+        mapped_x = mapped_fns_df.index.to_numpy()
+        mapped_names = mapped_fns_df['num_of_ideal_func'].to_numpy()
         output_list = []
-        # Selects the relevant dataframe and retrieves index
+        # Anti-joins the test points against the points mapped by each ideal function
         for ideal_func in mapped_fns_df['num_of_ideal_func'].unique():
-            _df = mapped_fns_df.loc[mapped_fns_df['num_of_ideal_func'] == ideal_func, 'y_test_func']
-            out = set(_df.index.values)
-            # Uses set difference to identify unmapped co-ordinates
-            dif = self._set_difference(self.test_df, out)
-            # Appends the unmapped points to a list
-            for item in dif:
-                y_ = self.test_df.loc[self.test_df.index == item, 'y_test_func'].values.tolist()
-                for data in y_:
-                    _output = (item, data, ideal_func)
-                    output_list.append(_output)
+            _df = self._anti_join(mapped_x[mapped_names == ideal_func])
+            _df['num_of_ideal_func'] = ideal_func
+            output_list.append(_df)
 
         # Returns a Pandas dataframe with results
-        unmapped_output_df = pd.DataFrame(output_list, columns=['x', 'y_test_func', 'num_of_ideal_func'])
+        if output_list:
+            unmapped_output_df = pd.concat(output_list, ignore_index=True)
+        else:
+            unmapped_output_df = pd.DataFrame(columns=['x', 'y_test_func', 'num_of_ideal_func'])
         unmapped_output_df.set_index(['num_of_ideal_func', 'x'], inplace=True, verify_integrity=False)
         unmapped_output_df.sort_index(inplace=True)
         return unmapped_output_df
 
+    @instrumented
+    @memoized('train_df', 'ideal_df', 'test_df')
     def unmapped_fns_set(self):
         """
         Creates dataframe of all unmapped test functions. Points not mapped by any function (zero of the 4),
@@ -156,24 +222,16 @@ class TestFunctionReturner(TrainFunctionReturner):
         Output:
             unmapped_output_df (dataframe) - x, y values for unmapped test values.
         """
-        # Uses set difference to identify unmapped co-ordinates
-        out = set(self.mapped_fns_df().index.values)
-        dif = self._set_difference(self.test_df, out)
-
-        # Appends the unmapped points to a list
-        output_list = []
-        for item in dif:
-            y_ = self.test_df.loc[self.test_df.index == item, 'y_test_func'].values.tolist()
-            for data in y_:
-                _output = (item, data)
-                output_list.append(_output)
+        # Anti-joins the test points against all mapped points
+        unmapped_output_df = self._anti_join(self.mapped_fns_df().index.to_numpy())
 
         # Returns a Pandas dataframe with results
-        unmapped_output_df = pd.DataFrame(output_list, columns=['x', 'y_test_func'])
         unmapped_output_df.set_index('x', inplace=True)
         unmapped_output_df.sort_index(inplace=True)
         return unmapped_output_df
 
+    @instrumented
+    @memoized('train_df', 'ideal_df', 'test_df')
     def unmapped_fns_in_range(self):
         """
         Checks the range of function values lying within each mapped ideal function and then re-checks for
@@ -184,26 +242,29 @@ class TestFunctionReturner(TrainFunctionReturner):
             unmapped_fns_in_range_df (dataframe) - mapped and unmapped points in range identified by 1
             and 0, respectively.
         """
-        my_list = []
         unmapped_fns = self.unmapped_fns()
         mapped_fns_df = self.mapped_fns_df()
         # Selects the mapped functions and adds 'mapped' = 1
         sub_df = mapped_fns_df.drop(['delta_y_test_func', 'square_root'], axis=1)
         sub_df['mapped'] = 1
-        # Finds the min and max for y values within the mapped function, to identify additional
+        # Finds the min and max for y values within each mapped function once, to identify additional
         # unmapped points within the range
-        for ideal_func in mapped_fns_df['num_of_ideal_func'].unique():
-            _sub_df = sub_df[sub_df['num_of_ideal_func'] == ideal_func]
-            y_min = _sub_df['y_test_func'].min()
-            y_max = _sub_df['y_test_func'].max()
-            for x, y in zip(unmapped_fns['y_test_func'].index,
-                            unmapped_fns['y_test_func'].values):
-                if x[0] == ideal_func:
-                    if y >= y_min and y <= y_max:
-                        my_list.append([x[1], y, ideal_func])
+        ideal_funcs = mapped_fns_df['num_of_ideal_func'].unique()
+        y_range = sub_df.groupby('num_of_ideal_func')['y_test_func'].agg(['min', 'max']).reindex(ideal_funcs)
+        func_pos = y_range.index.get_indexer(unmapped_fns.index.get_level_values('num_of_ideal_func'))
+        # Position -1 (function not mapped) picks the appended missing value, which is never in range
+        y_min = np.append(y_range['min'].to_numpy(dtype=np.float64), np.nan)[func_pos]
+        y_max = np.append(y_range['max'].to_numpy(dtype=np.float64), np.nan)[func_pos]
+        y = unmapped_fns['y_test_func'].to_numpy()
+        keep = np.flatnonzero((y >= y_min) & (y <= y_max))
+        # Keeps the points grouped by mapped function, in order of the functions' first mapped point
+        keep = keep[np.argsort(func_pos[keep], kind='stable')]
+        in_range = {'x': unmapped_fns.index.get_level_values('x').to_numpy()[keep],
+                    'y_test_func': y[keep],
+                    'num_of_ideal_func': unmapped_fns.index.get_level_values('num_of_ideal_func').to_numpy()[keep]}
 
         # Inserts the unmapped functions in range into a dataframe with 'mapped' = 0
-        _df = pd.DataFrame(my_list, columns=['x', 'y_test_func', 'num_of_ideal_func'])
+        _df = pd.DataFrame(in_range, columns=['x', 'y_test_func', 'num_of_ideal_func'])
         _df = _df.set_index('x', drop=True, verify_integrity=False)
         _df['mapped'] = 0
 
@@ -211,6 +272,8 @@ class TestFunctionReturner(TrainFunctionReturner):
         unmapped_fns_in_range_df['square_root'] = self.sq_root_number
         return unmapped_fns_in_range_df
 
+    @instrumented
+    @memoized('train_df', 'ideal_df', 'test_df')
     def summary_results_df(self):
         """
         Combines results of mapped and unmapped counts into a single dataframe.
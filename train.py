@@ -13,13 +13,16 @@
 
 
 # Library imports
+import numpy as np
 import pandas as pd
 from arithmetic import calc_diff
 from arithmetic import calc_sum
 from arithmetic import calc_square_root
 from arithmetic import calc_prod
-from arithmetic import square_number
-from arithmetic import sum_array
+from arithmetic import calc_abs
+from arithmetic import max_array
+from result_cache import ResultCache
+from result_cache import memoized
 
 
 class TrainFunctionReturner:
@@ -30,16 +33,66 @@ class TrainFunctionReturner:
     based on multiplying the largest deviation between two points by the square root of 2 - but other numbers
     can be inputted.
     Upper and lower boundaries will become the margins for which test points can be mapped further.
+    Results are memoized in the object's own result_cache, keyed on the input dataframes and
+    sq_root_number, so changing either recalculates. result_cache.info() reports hits and misses.
+    Objects created by a PipelineContext share the context's results instead.
     Inputs:
         train_df, ideal_df (dataframes) - created after being loaded by sqlalchemy.
         sq_root_number (int) - defaulted to 2 but other integers can be accepted.
     Outputs:
     """
+    # PipelineContext the object was created by, if any (see pipeline.PipelineContext.returner)
+    context = None
+
+    # Maximum number of elements held in the difference array while calculating sums of squares
+    chunk_elements = 2 ** 22
+
     # Initiates new constructor
     def __init__(self, train_df, ideal_df, sq_root_number=2):
         self.train_df = train_df
         self.ideal_df = ideal_df
         self.sq_root_number = sq_root_number
+        # Memoized results of this object
+        self.result_cache = ResultCache()
+
+    def _sum_of_squares_matrix(self, train_values, ideal_values):
+        """
+        Calculates the sum of squared errors for every (train column, ideal column) pair in one
+        batched operation. Ideal columns are processed in chunks so that the intermediate
+        (rows x train x chunk) difference array stays within chunk_elements.
+        Missing values contribute zero to the sum. Differences are always calculated in float64.
+        Input:
+            train_values (array) - 2d array of train function values (rows x train columns).
+            ideal_values (array) - 2d array of ideal function values (rows x ideal columns), float32 or
+            float64.
+        Output:
+            sse (array) - 2d array of sums of squares (train columns x ideal columns).
+        """
+        n_rows, n_train = train_values.shape
+        n_ideal = ideal_values.shape[1]
+        chunk = max(1, min(n_ideal, self.chunk_elements // max(1, n_rows * n_train)))
+        sse = np.empty((n_train, n_ideal), dtype=np.float64)
+        # Difference array reused by every chunk
+        buffer = np.empty((n_rows, n_train, chunk), dtype=np.float64)
+        for start in range(0, n_ideal, chunk):
+            stop = min(start + chunk, n_ideal)
+            # Calculates difference or error for the whole chunk of ideal functions
+            diff = calc_diff(train_values[:, :, np.newaxis], ideal_values[:, np.newaxis, start:stop],
+                             out=buffer[:, :, :stop - start], dtype=np.float64)
+            diff[np.isnan(diff)] = 0
+            # Squares and sums the error over the rows
+            sse[:, start:stop] = np.einsum('ijk,ijk->jk', diff, diff)
+        return sse
+
+    def _aligned_values(self, train_dataframe, ideal_dataframe):
+        """
+        Aligns the ideal functions on the train x values (unmatched x values become missing) and returns
+        both as arrays. float32 ideal data is kept as float32, so it is not copied to float64 as a whole.
+        """
+        if not train_dataframe.index.equals(ideal_dataframe.index):
+            ideal_dataframe = ideal_dataframe.reindex(train_dataframe.index)
+        ideal_dtype = np.float32 if (ideal_dataframe.dtypes == np.float32).all() else np.float64
+        return train_dataframe.to_numpy(dtype=np.float64), ideal_dataframe.to_numpy(dtype=ideal_dtype)
 
     def _calc_sum_of_squares(self, train_dataframe, ideal_dataframe):
         """
@@ -52,20 +105,10 @@ class TrainFunctionReturner:
             my_list (list) - list of train_df columns mapped to sum of squares for all
             functions in ideal_df.
         """
-        my_list = []
-        for column in train_dataframe.columns:
-            column_name, _sum_sq_diff = [], []
-            for col in ideal_dataframe.columns:
-                # Calculates difference or error and squaring this
-                diff = calc_diff(train_dataframe[column], ideal_dataframe[col])
-                sq_diff = square_number(diff)
-                sq_diff = sq_diff.fillna(0)
-                # Sums squared error
-                sum_sq_diff = sum_array(sq_diff)
-                column_name.append(col)
-                _sum_sq_diff.append(sum_sq_diff)
-            my_list.append([column_name, _sum_sq_diff])
-        return my_list
+        train_values, ideal_values = self._aligned_values(train_dataframe, ideal_dataframe)
+        sse = self._sum_of_squares_matrix(train_values, ideal_values)
+        column_name = list(ideal_dataframe.columns)
+        return [[column_name, row.tolist()] for row in sse]
 
     def _get_top_ideal_func(self, _calc_sum_of_squares):
         """
@@ -77,18 +120,19 @@ class TrainFunctionReturner:
             my_list (list) - list of train_df columns mapped to function with lowest sum of
             squares in ideal_df.
         """
-        my_list = []
-        for ls_data in _calc_sum_of_squares:
-            # Zips the column name with the sum_sq_diff
-            zipped = zip(ls_data[0], ls_data[1])
-            zipped = list(zipped)
-            # Sorts the list in ascending order
-            sorted_zip = sorted(zipped, key=lambda x: x[1])
-            # slice for [0] - i.e. the lowest sum_sq_diff
-            top_fns = sorted_zip[0][0]
-            my_list.append(top_fns)
-        return my_list
+        # argmin returns the first of any tied minimums, as the previous stable sort did
+        return [ls_data[0][int(np.argmin(ls_data[1]))] for ls_data in _calc_sum_of_squares]
 
+    @memoized('train_df', 'ideal_df', uses_sq_root=False)
+    def _sum_of_squares_table(self):
+        """
+        Returns the sums of squares of every (train column, ideal column) pair of train_df and ideal_df,
+        shared by ideal_function and selection_precision_check.
+        """
+        train_values, ideal_values = self._aligned_values(self.train_df, self.ideal_df)
+        return self._sum_of_squares_matrix(train_values, ideal_values)
+
+    @memoized('train_df', 'ideal_df', uses_sq_root=False)
     def ideal_function(self):
         """
         Calculates the square difference between each ideal function and each column in
@@ -100,13 +144,55 @@ class TrainFunctionReturner:
             output_dict (dictionary) - maps train_df column to the ideal function name.
         """
         # Calculates the sum of squares per ideal function versus train_df
-        calc_sum_of_squares = self._calc_sum_of_squares(self.train_df, self.ideal_df)
+        column_name = list(self.ideal_df.columns)
+        calc_sum_of_squares = [[column_name, row.tolist()] for row in self._sum_of_squares_table()]
         get_top_ideal_func = self._get_top_ideal_func(calc_sum_of_squares)
 
         # Outputs the results as a dictionary
         output_dict = {column: list_entry for (column, list_entry) in zip(self.train_df.columns, get_top_ideal_func)}
         return output_dict
 
+    def selection_precision_check(self):
+        """
+        Checks that storing the train and ideal functions at their dtype's precision (e.g. float32) cannot
+        have changed the ideal function selected for any train function.
+        The rounding of each stored value is at most its unit roundoff, so each error (train - ideal) is
+        changed by at most |train| * u + |ideal| * u, which bounds the change of every sum of squares. The
+        selection is unchanged if the lowest sum of squares is lower than every other ideal function's by
+        more than both of their bounds.
+        Input:
+            No explicit input but uses train_df and ideal_df.
+        Output:
+            output_dict (dictionary) - maps train_df column to True if its selection is unchanged.
+        """
+        train_values, ideal_values = self._aligned_values(self.train_df, self.ideal_df)
+        sse = self._sum_of_squares_table()
+        # Bounds of the rounding error of each stored train and ideal value
+        train_dtype = np.float32 if (self.train_df.dtypes == np.float32).all() else np.float64
+        train_rounding = self._rounding_bound(train_values, train_dtype)
+        ideal_rounding = self._rounding_bound(ideal_values, ideal_values.dtype)
+        # Sum over the rows of (train rounding + ideal rounding)^2, per (train column, ideal column) pair
+        rounding_sq = (np.einsum('ij,ij->j', train_rounding, train_rounding)[:, np.newaxis]
+                       + 2 * (train_rounding.T @ ideal_rounding)
+                       + np.einsum('ij,ij->j', ideal_rounding, ideal_rounding)[np.newaxis, :])
+        # (a + d)^2 - a^2 summed over the rows is at most 2 * sqrt(sse) * sqrt(sum d^2) + sum d^2
+        bound = 2 * np.sqrt(sse * rounding_sq) + rounding_sq
+
+        output_dict = dict()
+        for row, column in enumerate(self.train_df.columns):
+            best = int(np.argmin(sse[row]))
+            margin = sse[row] - sse[row, best] - bound[row] - bound[row, best]
+            margin[best] = np.inf
+            output_dict[column] = bool((margin > 0).all())
+        return output_dict
+
+    def _rounding_bound(self, values, dtype):
+        """
+        Returns the largest rounding error of each value when stored as dtype, zero for missing values.
+        """
+        unit_roundoff = np.finfo(dtype).eps / 2
+        return np.nan_to_num(calc_abs(values, dtype=np.float64)) * (unit_roundoff / (1 - unit_roundoff))
+
     def _validate_sq_root_number(self, number):
         """
         Asserts that the input for sq_root_number is an integer or float if supplied.
@@ -120,6 +206,7 @@ class TrainFunctionReturner:
         except AssertionError as exc:
             assert False, 'Incorrect input for square root, only integers or floats accepted'
 
+    @memoized('train_df', 'ideal_df')
     def mapped_fns(self):
         """
         Calculates the largest deviation between the train x,y and ideal x,y values, then multiplies
@@ -139,15 +226,25 @@ class TrainFunctionReturner:
             ideal = pd.Series(self.ideal_df[value], name='y_ideal')
             # Validates that an integer has been passed to calculate the square root
             self._validate_sq_root_number(self.sq_root_number)
-            # Finds the largest deviation between the train x,y and ideal x,y values.
-            large_dev = abs((calc_diff(self.train_df[key], ideal))).max()
+            # Aligns the train function on the ideal x values, if they differ
+            train, ideal_aligned = self.train_df[key], ideal
+            if not train.index.equals(ideal.index):
+                train, ideal_aligned = train.align(ideal_aligned)
+            # Finds the largest deviation between the train x,y and ideal x,y values, ignoring missing values
+            diff = calc_diff(train.to_numpy(dtype=np.float64), ideal_aligned.to_numpy(dtype=np.float64))
+            large_dev = max_array(calc_abs(diff, out=diff))
             # Then multiplies the largest deviation by the sqrt of 2 (or inputted number)
             large_dev = calc_prod(large_dev, calc_square_root(self.sq_root_number))
 
             # Adds and subtracts larg_dev from the ideal function to give
             # the upper & lower bounds per x, y value within the ideal fn.
-            upper = pd.Series(calc_sum(ideal, large_dev), name='upper_bound')
-            lower = pd.Series(calc_diff(ideal, large_dev), name='lower_bound')
+            # The bounds keep the ideal function's float dtype, so float32 ideal data gives float32 bounds
+            ideal_values = ideal.to_numpy()
+            bound_dtype = np.result_type(ideal_values.dtype, np.float32)
+            upper = pd.Series(calc_sum(ideal_values, large_dev, dtype=bound_dtype), index=ideal.index,
+                              name='upper_bound')
+            lower = pd.Series(calc_diff(ideal_values, large_dev, dtype=bound_dtype), index=ideal.index,
+                              name='lower_bound')
 
             # Returns a Pandas dataframe with results
             _df = pd.concat([ideal, upper, lower], axis=1)
@@ -1,14 +1,33 @@
 # Library imports
+import json
+import os
+import tempfile
 import unittest
+from unittest import mock
 import numpy as np
 import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import declarative_base
 
 # Imports own modules
 import etl_table
+import etl_sql
+import parse_cache
+import instrument
 import arithmetic
 import train
 import test
 import unmapped
+import graphing
+import dashboard
+import pipeline
+import incremental_clusters
+import polyfit
+import input_args_files
+import benchmark
+import batch
+import summary
+import shared_frames
 
 
 class ETLTableColNameCheck(unittest.TestCase):
@@ -30,6 +49,142 @@ class ETLTableColNameCheck(unittest.TestCase):
         self.assertRaises(ValueError, etl_table.TableConverter({'test': './test'})._cast_string_to_float,
                           self.mock_list_w_dict)
 
+    def test_table_to_columns(self):
+        """
+        Tests the csv is read across chunks into renamed float columns
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'train.csv')
+            with open(file_path, 'w') as csv_file:
+                csv_file.write('x,y1\n1,2.5\n2,3\n3,-1\n')
+            columns = etl_table.TableConverter({'train': file_path}).table_to_columns(chunk_size=2)
+        self.assertEqual(list(columns.keys()), ['x', 'y1_train_func'])
+        self.assertEqual(columns['y1_train_func'].tolist(), [2.5, 3.0, -1.0])
+
+    def test_table_to_columns_blank_lines(self):
+        """
+        Tests blank lines in the csv are skipped, including a chunk of only blank lines
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'train.csv')
+            with open(file_path, 'w') as csv_file:
+                csv_file.write('x,y1\n1,2\n\n\n3,4\n\n')
+            columns = etl_table.TableConverter({'train': file_path}).table_to_columns(chunk_size=2)
+        self.assertEqual(columns['x'].tolist(), [1.0, 3.0])
+        self.assertEqual(columns['y1_train_func'].tolist(), [2.0, 4.0])
+
+    def test_parse_cache(self):
+        """
+        Tests the parsed columns are mapped from the cache until the csv changes
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'train.csv')
+            with open(file_path, 'w') as csv_file:
+                csv_file.write('x,y1\n1,2.5\n')
+            cache = parse_cache.ParseCache(os.path.join(folder, 'cache'))
+            converter = etl_table.TableConverter({'train': file_path}, cache)
+            self.assertEqual(converter.table_to_columns()['y1_train_func'].tolist(), [2.5])
+            converter._parse_columns = None
+            self.assertEqual(converter.table_to_columns()['x'].tolist(), [1.0])
+            with open(file_path, 'a') as csv_file:
+                csv_file.write('2,3\n')
+            self.assertEqual(etl_table.TableConverter({'train': file_path}, cache).table_to_columns()['x'].tolist(),
+                             [1.0, 2.0])
+            self.assertEqual([name for name in os.listdir(os.path.join(folder, 'cache')) if name.endswith('.tmp')], [])
+
+    def test_parse_cache_edit_during_parse(self):
+        """
+        Tests a csv changed while it is parsed is parsed again by the next run, rather than cached as the old columns
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'train.csv')
+            with open(file_path, 'w') as csv_file:
+                csv_file.write('x,y1\n1,2\n')
+            cache = parse_cache.ParseCache(os.path.join(folder, 'cache'))
+
+            def parse_while_edited():
+                with open(file_path, 'w') as csv_file:
+                    csv_file.write('x,y1\n1,3\n')
+                os.utime(file_path, ns=(1, 1))
+                return {'x': np.array([1.0]), 'y1_train_func': np.array([2.0])}
+            cache.columns(file_path, parse_while_edited)
+            self.assertEqual(cache.columns(file_path, lambda: {'x': np.array([1.0]),
+                                                               'y1_train_func': np.array([3.0])})
+                             ['y1_train_func'].tolist(), [3.0])
+
+    def test_parse_cache_shape_mismatch(self):
+        """
+        Tests a cached data file whose shape does not match its manifest is treated as a cache miss
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'train.csv')
+            with open(file_path, 'w') as csv_file:
+                csv_file.write('x,y1\n1,2\n')
+            cache = parse_cache.ParseCache(os.path.join(folder, 'cache'))
+            columns = {'x': np.array([1.0]), 'y1_train_func': np.array([2.0])}
+            cache.columns(file_path, lambda: columns)
+            np.save(cache._paths(file_path)[1], np.zeros((1, 1)))
+            self.assertEqual(cache.columns(file_path, lambda: columns)['y1_train_func'].tolist(), [2.0])
+
+
+class ETLSQLBulkInsert(unittest.TestCase):
+    def setUp(self):
+        self.mock_list_w_dict = [{'x': float(i), 'y1_train_func': i * 2.0, 'name': 'train'} for i in range(5)]
+
+    def test_bulk_insert(self):
+        """
+        Tests bulk_insert loads every row when the data spans several batches
+        """
+        table_ins = etl_sql.SQLTableBuilder(self.mock_list_w_dict)
+        class_dict, data_to_load = table_ins.schema_create()
+        base = declarative_base()
+        table_class = type(class_dict['clsname'], (base,), class_dict)
+        engine = create_engine("sqlite://")
+        base.metadata.create_all(engine)
+        table_ins.bulk_insert(engine, table_class.__table__, data_to_load, batch_size=2)
+        with engine.connect() as conn:
+            rows = conn.execute(table_class.__table__.select()).fetchall()
+        self.assertEqual(len(rows), 5)
+
+    def test_source_registry(self):
+        """
+        Tests a table is only current while its csv contents are unchanged
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'train.csv')
+            with open(file_path, 'w') as csv_file:
+                csv_file.write('x,y1\n1,2\n')
+            engine = create_engine("sqlite:///" + os.path.join(folder, 'store.db'))
+            registry = etl_sql.SourceRegistry(engine)
+            self.assertFalse(registry.is_current('source_files', file_path))
+            registry.record('source_files')
+            self.assertTrue(etl_sql.SourceRegistry(engine).is_current('source_files', file_path))
+            with open(file_path, 'a') as csv_file:
+                csv_file.write('2,3\n')
+            self.assertFalse(registry.is_current('source_files', file_path))
+            engine.dispose()
+
+
+class ETLSQLTableReader(unittest.TestCase):
+    def setUp(self):
+        self.mock_list_w_dict = [{'x': x, 'y1_ideal_func': x * 2.0, 'y2_ideal_func': -x, 'name': 'ideal'}
+                                 for x in [3.0, 1.0, 2.0]]
+
+    def test_read_frame(self):
+        """
+        Tests requested columns are read across chunks, ordered by x
+        """
+        table_ins = etl_sql.SQLTableBuilder(self.mock_list_w_dict)
+        class_dict, data_to_load = table_ins.schema_create()
+        base = declarative_base()
+        table_class = type(class_dict['clsname'], (base,), class_dict)
+        engine = create_engine("sqlite://")
+        base.metadata.create_all(engine)
+        table_ins.bulk_insert(engine, table_class.__table__, data_to_load)
+        df = etl_sql.SQLTableReader(engine, 'Ideal', chunk_size=2).read_frame(['y02_ideal_func'])
+        self.assertEqual(df.index.tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(df['y02_ideal_func'].tolist(), [-1.0, -2.0, -3.0])
+
 
 class TestTrainFunction(unittest.TestCase):
     def setUp(self):
@@ -44,6 +199,50 @@ class TestTrainFunction(unittest.TestCase):
         self.assertEqual(self.mock_train_obj._calc_sum_of_squares(self.mock_df_1, self.mock_df_2)[0][1],
                          [52, 34])
 
+    def test_sum_of_squares_matrix_chunked(self):
+        """
+        Tests that chunking over ideal columns gives the same sums of squares as a single chunk.
+        """
+        self.mock_train_obj.chunk_elements = 1
+        self.assertEqual(self.mock_train_obj._calc_sum_of_squares(self.mock_df_1, self.mock_df_2),
+                         [[['col_1', 'col_2'], [52, 34]], [['col_1', 'col_2'], [106, 104]]])
+        self.assertEqual(self.mock_train_obj._sum_of_squares_matrix(np.ones((3, 2)), np.ones((3, 0))).shape, (2, 0))
+
+    def test_selection_precision_check(self):
+        """
+        Tests that float32 ideal data passes the check unless two ideal functions are within rounding of each other.
+        """
+        ideal = self.mock_df_2.astype(np.float32)
+        self.assertEqual(train.TrainFunctionReturner(self.mock_df_1, ideal).selection_precision_check(),
+                         {'col_1': True, 'col_2': True})
+        ideal['col_3'] = ideal['col_2'] + np.float32(1e-7)
+        self.assertFalse(train.TrainFunctionReturner(self.mock_df_1, ideal).selection_precision_check()['col_1'])
+
+    def test_selection_precision_check_flip(self):
+        """
+        Tests that a near-tie whose selection flips when the train and ideal data are rounded to float32 fails the check.
+        """
+        ulp = 2.0 ** -23
+        train_df = pd.DataFrame({'y1': [1.5 + 0.45 * ulp]}, index=[0.0])
+        ideal_df = pd.DataFrame({'a': [1.5 - 0.45 * ulp], 'b': [1.5 + 1.3 * ulp]}, index=[0.0])
+        train_32, ideal_32 = train_df.astype(np.float32), ideal_df.astype(np.float32)
+        self.assertEqual(train.TrainFunctionReturner(train_df, ideal_df).ideal_function(), {'y1': 'b'})
+        self.assertEqual(train.TrainFunctionReturner(train_32, ideal_32).ideal_function(), {'y1': 'a'})
+        self.assertEqual(train.TrainFunctionReturner(train_32, ideal_32).selection_precision_check(), {'y1': False})
+
+    def test_mapped_fns_float32(self):
+        """
+        Tests that float32 ideal data gives float32 bounds in the mapped frames, which float32_bytes_saved counts.
+        """
+        train_df = pd.DataFrame({'y1': [1.0, 2.0, 3.0]}, dtype=np.float32)
+        ideal_df = pd.DataFrame({'a': [1.5, 2.0, 2.5], 'b': [5.0, 6.0, 7.0]}, dtype=np.float32)
+        mapped = train.TrainFunctionReturner(train_df, ideal_df).mapped_fns()
+        self.assertEqual(mapped[0]['upper_bound'].dtype, np.float32)
+        self.assertEqual(mapped[0]['lower_bound'].dtype, np.float32)
+        bound_bytes = sum(df['upper_bound'].nbytes + df['lower_bound'].nbytes for df in mapped)
+        self.assertEqual(etl_table.float32_bytes_saved(mapped) - etl_table.float32_bytes_saved(
+            [df.drop(columns=['upper_bound', 'lower_bound']) for df in mapped]), bound_bytes)
+
     def test_get_top_ideal_func(self):
         """
         Tests that _get_top_ideal_func function returns the column for the smallest number.
@@ -63,14 +262,122 @@ class TestTestFunction(unittest.TestCase):
     def setUp(self):
         self.mock_dict = {'col_1': [3, 2, 1, 0], 'col_2': [5, 7, 9, 11]}
         self.mock_df = pd.DataFrame.from_dict(self.mock_dict)
-        self.mock_array = np.array([0.0, 4, 2, 8])
         self.mock_train_obj = test.TestFunctionReturner(self.mock_df, self.mock_df, self.mock_df, 1)
 
-    def test_set_difference(self):
+    def test_result_cache(self):
+        """
+        Tests that repeated calls are served from the object's cache as copies, and that a new square root recalculates.
+        """
+        mock_train_obj = train.TrainFunctionReturner(self.mock_df, self.mock_df, 2)
+        first = mock_train_obj.mapped_fns()
+        first[0]['y_ideal'] = -1
+        pd.testing.assert_series_equal(mock_train_obj.mapped_fns()[0]['y_ideal'], self.mock_df['col_1'],
+                                       check_names=False)
+        self.assertEqual(mock_train_obj.result_cache.info()['hits'], 1)
+        self.assertEqual(train.TrainFunctionReturner(self.mock_df, self.mock_df, 2).result_cache.info()['size'], 0)
+        mock_train_obj.sq_root_number = 3
+        self.assertEqual(mock_train_obj.mapped_fns()[0]['square_root'].iloc[0], 3)
+        self.assertEqual(mock_train_obj.result_cache.info()['hits'], 2)
+
+    def test_result_cache_frame_changes(self):
+        """
+        Tests that modifying a dataframe in place, or assigning a different one, recalculates the cached selection.
+        """
+        train_df = pd.DataFrame({'y1_train_func': [1.0, 2.0]})
+        ideal_df = pd.DataFrame({'y1_ideal_func': [1.0, 2.0], 'y2_ideal_func': [5.0, 5.0]})
+        train_obj = train.TrainFunctionReturner(train_df, ideal_df)
+        self.assertEqual(train_obj.ideal_function(), {'y1_train_func': 'y1_ideal_func'})
+        ideal_df['y1_ideal_func'] = [9.0, 9.0]
+        self.assertEqual(train_obj.ideal_function(), {'y1_train_func': 'y2_ideal_func'})
+        train_obj.ideal_df = pd.DataFrame({'y1_ideal_func': [1.0, 2.0], 'y2_ideal_func': [5.0, 5.0]})
+        self.assertEqual(train_obj.ideal_function(), {'y1_train_func': 'y1_ideal_func'})
+
+        context = pipeline.PipelineContext(train_df, ideal_df, train_df)
+        self.assertEqual(context.returner(test.TestFunctionReturner, 2).ideal_function(),
+                         {'y1_train_func': 'y2_ideal_func'})
+        context.ideal_df = pd.DataFrame({'y1_ideal_func': [1.0, 2.0], 'y2_ideal_func': [5.0, 5.0]})
+        self.assertEqual(context.returner(test.TestFunctionReturner, 2).ideal_function(),
+                         {'y1_train_func': 'y1_ideal_func'})
+
+    def test_pipeline_context(self):
+        """
+        Tests that objects created from one pipeline context share the ideal function selection.
+        """
+        context = pipeline.PipelineContext(self.mock_df, self.mock_df, self.mock_df)
+        first = context.returner(test.TestFunctionReturner, 2).ideal_function()
+        self.assertEqual(context.returner(unmapped.UnmappedClusters, 6).ideal_function(), first)
+        # The selection and its sums of squares are each calculated once
+        self.assertEqual(context.result_cache.info(), {'hits': 1, 'misses': 2, 'size': 2})
+
+    def test_mapped_fns_row_by_row(self):
+        """
+        Tests _mapped_fns matches each test point to every ideal row with equal x, as a row by row loop does,
+        including repeated ideal x values
+        """
+        index = pd.Index([0.0, 1, 1, 2, 3], name='x')
+        train_df = pd.DataFrame({'y1_train_func': [0.0, 1.2, 0.8, 2.1, 3.0]}, index=index)
+        ideal_df = pd.DataFrame({'y01_ideal_func': [0.0, 1.0, 1.3, 2.0, 3.1],
+                                 'y02_ideal_func': [5.0, 5.0, 5.0, 5.0, 5.0]}, index=index)
+        test_df = pd.DataFrame({'y_test_func': [1.1, 2.0, 9.0, 0.1, 1.6]}, index=pd.Index([1.0, 2, 3, 0, 1], name='x'))
+        test_obj = test.TestFunctionReturner(train_df, ideal_df, test_df, 2)
+        expected = []
+        for line in test_df.itertuples():
+            for ideal_fn in test_obj.mapped_fns():
+                for row in ideal_fn.itertuples():
+                    if line.Index == row.Index and abs(line.y_test_func - row.y_ideal) <= row.prod_max_dev_sq_root:
+                        expected.append((line.Index, line.y_test_func, abs(line.y_test_func - row.y_ideal),
+                                         row.square_root, row.name))
+        self.assertEqual(len(test_obj._mapped_fns()), len(expected))
+        for mapped, row in zip(test_obj._mapped_fns(), expected):
+            self.assertEqual((mapped[0], mapped[1], mapped[3], mapped[4]), (row[0], row[1], row[3], row[4]))
+            self.assertAlmostEqual(mapped[2], row[2])
+
+    def test_anti_join(self):
         """
-        Tests that _set_difference function is returning expected output
+        Tests unmapped_fns and unmapped_fns_set drop every test point at a mapped x, keep repeated unmapped x
+        values, and leave out an ideal function with no mapped points ('b').
         """
-        self.assertEqual(self.mock_train_obj._set_difference(self.mock_df, self.mock_array), {1, 3})
+        idx = pd.Index([0.0, 1, 2, 3], name='x')
+        train_df = pd.DataFrame({'y1': [0.1, 1.1, 2.1, 3.1], 'y2': [10.1, 10.1, 10.1, 10.1]}, index=idx)
+        ideal_df = pd.DataFrame({'a': [0.0, 1, 2, 3], 'b': [10.0, 10, 10, 10], 'c': [50.0, 50, 50, 50]}, index=idx)
+        test_df = pd.DataFrame({'y_test_func': [0.0, 5.0, 1.05, 2.0, 30.0, 7.0, 8.0]},
+                               index=pd.Index([0.0, 0, 1, 2, 2, 3, 3], name='x'))
+        test_obj = test.TestFunctionReturner(train_df, ideal_df, test_df, 1)
+        self.assertEqual(test_obj.ideal_function(), {'y1': 'a', 'y2': 'b'})
+
+        unmapped_fns = test_obj.unmapped_fns()
+        self.assertEqual(unmapped_fns.index.names, ['num_of_ideal_func', 'x'])
+        self.assertEqual(unmapped_fns.index.tolist(), [('a', 3.0), ('a', 3.0)])
+        self.assertEqual(unmapped_fns['y_test_func'].tolist(), [7.0, 8.0])
+
+        unmapped_fns_set = test_obj.unmapped_fns_set()
+        self.assertEqual(unmapped_fns_set.index.name, 'x')
+        self.assertEqual(unmapped_fns_set.index.tolist(), [3.0, 3.0])
+        self.assertEqual(unmapped_fns_set['y_test_func'].tolist(), [7.0, 8.0])
+
+    def test_unmapped_fns_in_range(self):
+        """
+        Tests unmapped_fns_in_range keeps the unmapped points within each mapped function's y range, including
+        points on the range boundaries, for a function ('a') with unmapped points and one ('b') without.
+        """
+        idx = pd.Index([0.0, 1, 2, 3, 4], name='x')
+        train_df = pd.DataFrame({'y1': [0.1, 1.1, 2.1, 3.1, 4.1], 'y2': [10.1, 11.1, 12.1, 13.1, 14.1]}, index=idx)
+        ideal_df = pd.DataFrame({'a': [0.0, 1, 2, 3, 4], 'b': [10.0, 11, 12, 13, 14], 'c': [100.0] * 5}, index=idx)
+        test_df = pd.DataFrame({'y_test_func': [0.0, 10.0, 11.0, 0.0, 2.0, 12.0, 13.0, 2.0, 14.0, 1.0, -0.5]},
+                               index=pd.Index([0.0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 4], name='x'))
+        test_obj = test.TestFunctionReturner(train_df, ideal_df, test_df, 1)
+        self.assertEqual(test_obj.ideal_function(), {'y1': 'a', 'y2': 'b'})
+
+        in_range = test_obj.unmapped_fns_in_range()
+        self.assertEqual(in_range.index.name, 'x')
+        self.assertEqual(in_range.columns.tolist(), ['y_test_func', 'num_of_ideal_func', 'mapped', 'square_root'])
+        # Unmapped points of 'a' on its range [0, 2] boundaries and inside it, then the mapped points
+        self.assertEqual(in_range.set_index('num_of_ideal_func', append=True).index.tolist(),
+                         [(1.0, 'a'), (3.0, 'a'), (4.0, 'a'), (0.0, 'a'), (0.0, 'b'), (1.0, 'b'), (2.0, 'a'),
+                          (2.0, 'b'), (3.0, 'b'), (4.0, 'b')])
+        self.assertEqual(in_range['y_test_func'].tolist(), [0.0, 2.0, 1.0, 0.0, 10.0, 11.0, 2.0, 12.0, 13.0, 14.0])
+        self.assertEqual(in_range['mapped'].tolist(), [0, 0, 0, 1, 1, 1, 1, 1, 1, 1])
+        self.assertEqual(in_range['square_root'].tolist(), [1] * 10)
 
 
 class TestUnmappedFunction(unittest.TestCase):
@@ -86,6 +393,200 @@ class TestUnmappedFunction(unittest.TestCase):
         self.assertEqual(self.mock_unmapped_obj._euclidean_dist(self.mock_df['col_1'].values,
                                                                 self.mock_df['col_2'].values), 5)
 
+    def test_grid_radius_graph(self):
+        """
+        Tests that grid bucketing finds only the neighbours within eps, including those in adjacent cells.
+        """
+        points = np.array([[0.0, 0.0], [0.9, 0.0], [3.0, 3.0], [3.5, 3.5]])
+        graph = unmapped.grid_radius_graph(points, 1.0)
+        self.assertEqual(graph[0, 1], 0.9)
+        self.assertAlmostEqual(graph[2, 3], np.hypot(0.5, 0.5))
+        self.assertEqual(graph[0, 2], 0)
+
+    def test_incremental_clusters(self):
+        """
+        Tests that a second batch joins an existing cluster and updates its centroid, or forms a new cluster.
+        """
+        clusters = incremental_clusters.IncrementalClusters(eps=1, min_samples=2)
+        clusters.add_points(pd.DataFrame({'y_test_func': [0.0, 0.5, 10.0]}, index=[0.0, 0.0, 10.0]))
+        self.assertEqual(clusters.cluster_centers()['y_bar'].tolist(), [0.25])
+        clusters.add_points(pd.DataFrame({'y_test_func': [1.0, 10.5]}, index=[0.0, 10.0]))
+        self.assertEqual(clusters.cluster_centers()['y_bar'].tolist(), [0.5, 10.25])
+        self.assertEqual(clusters.clustered_df()['dbscan_labels'].tolist(), ['0', '0', '0', '1', '1'])
+
+    def test_fit_polynomials(self):
+        """
+        Tests that a cubic is recovered in a batched fit and chosen over a straight line by normalised RMSE.
+        """
+        x = np.array([-2.0, -1, 0, 1, 2, 3])
+        fits = polyfit.fit_polynomials([x, x[:4]], [x ** 3, 2 * x[:4] + 1], degrees=(1, 3))
+        self.assertEqual(fits[0]['degree'], 3)
+        np.testing.assert_allclose(fits[0]['coefficients'], [0, 0, 0, 1], atol=1e-9)
+        np.testing.assert_allclose(fits[1]['grid_y'], [-3, -1, 1, 3])
+
+
+class TestGraphingDownsample(unittest.TestCase):
+    def setUp(self):
+        self.mock_x = np.arange(100, dtype=float)
+        self.mock_y = np.zeros(100)
+        self.mock_y[37] = 10
+
+    def test_lttb_indices(self):
+        """
+        Tests downsampling keeps the end points and the peak, and keeps short lines whole.
+        """
+        idx = graphing.lttb_indices(self.mock_x, self.mock_y, 10)
+        self.assertEqual(len(idx), 10)
+        self.assertEqual((idx[0], idx[-1]), (0, 99))
+        self.assertIn(37, idx)
+        self.assertEqual(len(graphing.lttb_indices(self.mock_x, self.mock_y, 500)), 100)
+
+    def test_dashboard_shared_source(self):
+        """
+        Tests that the mapped and unmapped graphs of a function share their data sources in a dashboard.
+        """
+        board = dashboard.Dashboard()
+        first = board.source(('y1', 'y_ideal'), {'x': self.mock_x, 'y': self.mock_y})
+        second = board.source(('y1', 'y_ideal'), {'x': self.mock_x, 'y': self.mock_y})
+        self.assertIs(first, second)
+        self.assertIsNot(dashboard.data_source(None, ('y1', 'y_ideal'), {'x': self.mock_x}), first)
+
+
+class TestSummaryParallel(unittest.TestCase):
+    def test_shared_frame(self):
+        """
+        Tests a dataframe attached from shared memory equals the original, float32 values staying float32
+        """
+        df = pd.DataFrame({'y1': np.array([1.5, 2, 3], dtype=np.float32)}, index=pd.Index([0.0, 1, 2], name='x'))
+        frame = shared_frames.SharedFrame(df)
+        try:
+            shm, attached = shared_frames.attach_frame(frame.spec)
+            pd.testing.assert_frame_equal(attached, df)
+            del attached
+            shm.close()
+        finally:
+            frame.close()
+
+    def test_parallel_summary(self):
+        """
+        Tests the summary calculated on worker processes from shared dataframes equals the serial summary
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            files_folder = benchmark.generate_dataset(folder, x_points=100, ideal_funcs=10, test_points=40)
+            train_df, ideal_df, test_df = (etl_table.df_from_columns(etl_table.TableConverter(files_folder[name])
+                                                                     .table_to_columns())
+                                           for name in ('train', 'ideal', 'test'))
+        serial = summary.SummaryReporter(2, 4, 1, train_df, ideal_df, test_df).summary()
+        parallel = summary.SummaryReporter(2, 4, 1, train_df, ideal_df, test_df, processes=2).summary()
+        pd.testing.assert_frame_equal(parallel, serial)
+
+    def test_parallel_render(self):
+        """
+        Tests the graphs saved on a process pool are the same files as the graphs saved in this process
+        """
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            files_folder = benchmark.generate_dataset(folder, x_points=100, ideal_funcs=10, test_points=40)
+            train_df, ideal_df, test_df = (etl_table.df_from_columns(etl_table.TableConverter(files_folder[name])
+                                                                     .table_to_columns())
+                                           for name in ('train', 'ideal', 'test'))
+            context = pipeline.PipelineContext(train_df, ideal_df, test_df)
+            saved = dict()
+            try:
+                for processes in (1, 2):
+                    os.makedirs(os.path.join(folder, str(processes), 'main_graphs'))
+                    os.chdir(os.path.join(folder, str(processes)))
+                    context.returner(graphing.IdealPlotter, 2).mapped_plotted_fns(processes=processes)
+                    saved[processes] = sorted(os.listdir('main_graphs'))
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(len(saved[1]), 4)
+        self.assertEqual(saved[2], saved[1])
+
+
+class TestBatch(unittest.TestCase):
+    def test_shared_ideal_parse(self):
+        """
+        Tests that folders with the same ideal file share one parsed ideal dataframe, with a file linked from
+        several folders hashed once, and that a folder without the csv files is reported as failed.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            for name, seed in [('run_a', 0), ('run_b', 0), ('run_c', 1)]:
+                os.makedirs(os.path.join(folder, name))
+                benchmark.generate_dataset(os.path.join(folder, name), x_points=50, ideal_funcs=5, test_points=10,
+                                           seed=seed)
+            os.makedirs(os.path.join(folder, 'run_d'))
+            for name in ('train.csv', 'test.csv'):
+                os.symlink(os.path.join(folder, 'run_a', name), os.path.join(folder, 'run_d', name))
+            os.symlink(os.path.join(folder, 'run_c', 'ideal.csv'), os.path.join(folder, 'run_d', 'ideal.csv'))
+            folders = input_args_files.expand_folders([os.path.join(folder, 'run_*')])
+            self.assertEqual([os.path.basename(name) for name in folders], ['run_a', 'run_b', 'run_c', 'run_d'])
+            with mock.patch.object(batch, 'file_content_hash', wraps=batch.file_content_hash) as hash_calls:
+                keys, ideals, errors = batch._parse_ideals([input_args_files.get_file_names(name)
+                                                            for name in folders], None, np.float64)
+            self.assertEqual(hash_calls.call_count, 3)
+            self.assertEqual((keys[0] == keys[1], keys[0] == keys[2], keys[2] == keys[3], len(ideals), errors),
+                             (True, False, True, 2, {}))
+
+            os.makedirs(os.path.join(folder, 'empty'))
+            summary = batch.run_batch([os.path.join(folder, 'empty')], os.path.join(folder, 'out'), cache_dir=None)
+            self.assertEqual(list(summary['status']), ['failed'])
+            self.assertTrue(os.path.exists(os.path.join(folder, 'out', 'batch_summary.csv')))
+
+    def test_bad_ideal_file(self):
+        """
+        Tests that a folder whose ideal file cannot be parsed is reported as failed, while the other folders run.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            folders = [os.path.join(folder, name) for name in ('good', 'bad')]
+            for name in folders:
+                os.makedirs(name)
+                benchmark.generate_dataset(name, x_points=100, ideal_funcs=10, test_points=40)
+            with open(os.path.join(folder, 'bad', 'ideal.csv'), 'w') as csv_file:
+                csv_file.write('x,y1,zz\n1,2,3\n')
+            summary = batch.run_batch(folders, os.path.join(folder, 'out'), cache_dir=None)
+            self.assertEqual(list(summary['status']), ['ok', 'failed'])
+            self.assertIn('AssertionError', summary['error'].iloc[1])
+            self.assertTrue(os.path.exists(os.path.join(folder, 'out', 'batch_summary.csv')))
+            self.assertEqual(batch._worker_ideals, {})
+
+    def test_worker_pool(self):
+        """
+        Tests that running the folders on a worker pool, with the shared ideal dataframe, gives the same
+        outputs as running them one by one.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            folders = [os.path.join(folder, name) for name in ('run_a', 'run_b')]
+            for name, seed in zip(folders, (0, 0)):
+                os.makedirs(name)
+                benchmark.generate_dataset(name, x_points=100, ideal_funcs=10, test_points=40, seed=seed)
+            serial = batch.run_batch(folders, os.path.join(folder, 'serial'), workers=1, cache_dir=None)
+            pooled = batch.run_batch(folders, os.path.join(folder, 'pooled'), workers=2, cache_dir=None)
+            self.assertEqual(list(pooled['status']), ['ok', 'ok'])
+            self.assertEqual(list(pooled['folder']), folders)
+            self.assertEqual(list(pooled['ideal_functions']), list(serial['ideal_functions']))
+            for name in ('run_a', 'run_b'):
+                for output in ('mapped.csv', 'summary.csv'):
+                    pd.testing.assert_frame_equal(pd.read_csv(os.path.join(folder, 'pooled', name, output)),
+                                                  pd.read_csv(os.path.join(folder, 'serial', name, output)))
+                self.assertTrue(os.path.exists(os.path.join(folder, 'pooled', name, 'dashboard.html')))
+
+
+class TestInstrument(unittest.TestCase):
+    def test_stage(self):
+        """
+        Tests that a stage writes a JSON line with its name, timings and row count.
+        """
+        with self.assertLogs('metrics', level='INFO') as logs:
+            with instrument.stage('mock_stage') as record:
+                record.rows = 3
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual((logged['stage'], logged['rows'], logged['ok']), ('mock_stage', 3, True))
+        # Resident memory is the process's peak since it started, named so it is not read as the stage's peak
+        self.assertIn('process_peak_rss_bytes', logged)
+        self.assertNotIn('peak_rss_bytes', logged)
+        self.assertGreaterEqual(logged['wall_seconds'], 0)
+
 
 class TestArithmetic(unittest.TestCase):
     def setUp(self):
@@ -128,6 +629,7 @@ class TestArithmetic(unittest.TestCase):
         Tests square root calculation working as expected
         """
         self.assertEqual(arithmetic.calc_square_root(16), 4)
+        self.assertRaises(ValueError, arithmetic.calc_square_root, -2)
 
     def test_calc_prod(self):
         """
@@ -135,6 +637,17 @@ class TestArithmetic(unittest.TestCase):
         """
         self.assertEqual(arithmetic.calc_prod(7, 3), 21)
 
+    def test_out_and_axis(self):
+        """
+        Tests results are written into an out buffer and that reductions follow axis, ignoring missing maximums
+        """
+        buffer = np.empty(4)
+        result = arithmetic.calc_diff(self.mock_y1, self.mock_y2, out=buffer)
+        self.assertIs(result, buffer)
+        self.assertEqual(arithmetic.sum_array(np.ones((2, 3)), axis=1).tolist(), [3, 3])
+        self.assertEqual(arithmetic.max_array(np.array([1, np.nan, 3])), 3)
+        self.assertTrue(np.isnan(arithmetic.max_array(np.array([]))))
+
     def test_norm_root_mean_squared_error(self):
         decimal_place = 3
         # error message in case if test case got failed
@@ -143,6 +656,19 @@ class TestArithmetic(unittest.TestCase):
                                norm_root_mean_squared_error(self.mock_y1, self.mock_y2),
                                0.0816, decimal_place, message)
 
+    def test_rmse_accumulator(self):
+        """
+        Tests that the normalised RMSE accumulated chunk by chunk equals the figure calculated over the whole array
+        """
+        rng = np.random.default_rng(0)
+        y1, y2 = rng.normal(size=1000), rng.normal(size=1000)
+        expected = np.sqrt(np.mean((y1 - y2) ** 2)) / (y1.max() - y1.min())
+        for chunk_size in (1, 7, 256, 1000, 4096):
+            accumulator = arithmetic.RMSEAccumulator()
+            for start in range(0, len(y1), chunk_size):
+                accumulator.update(y1[start:start + chunk_size], y2[start:start + chunk_size])
+            self.assertAlmostEqual(accumulator.norm_rmse(), expected)
+            self.assertAlmostEqual(arithmetic.norm_root_mean_squared_error(y1, y2, chunk_size=chunk_size), expected)
 
 if __name__ == '__main__':
     unittest.main()
@@ -10,8 +10,9 @@
 
 
 # Library imports
+import numpy as np
 import pandas as pd
-import operator
+from scipy.sparse import csr_matrix
 from os import getcwd
 
 from bokeh.transform import factor_cmap
@@ -24,20 +25,82 @@ from bokeh.io import save
 from bokeh.palettes import Spectral11
 
 from sklearn.cluster import DBSCAN
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.linear_model import LinearRegression
 
 # Imports own modules
 from test import TestFunctionReturner
+from instrument import instrumented
+from result_cache import memoized
+from incremental_clusters import IncrementalClusters
+from polyfit import fit_polynomials
 from arithmetic import calc_diff
 from arithmetic import square_number
 from arithmetic import calc_square_root
 from arithmetic import sum_array
-from arithmetic import norm_root_mean_squared_error
 
 graphs_directory = getcwd() + '/additional_graphs/'
 
 
+def _ordinal(number):
+    """
+    Returns a number as an ordinal string, e.g. 3 -> '3rd'.
+    """
+    suffix = 'th' if 10 <= number % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th')
+    return str(number) + suffix
+
+
+def _save_or_add(p, name, dashboard=None):
+    """
+    Saves a graph to the additional_graphs folder as name.html, or adds it to the dashboard as tab name.
+    """
+    if dashboard is None:
+        output_file(graphs_directory + name + '.html')
+        save(p)
+    else:
+        dashboard.add(name, p)
+
+
+def grid_radius_graph(points, eps):
+    """
+    Finds the neighbours within eps of every point by bucketing the points into a grid of eps sized
+    cells, so that only points in the same or adjacent cells are compared.
+    Input:
+        points (array) - 2d array of x, y co-ordinates.
+        eps (float) - neighbourhood radius.
+    Output:
+        graph (csr_matrix) - sparse matrix of distances between neighbouring points, for DBSCAN with
+        metric='precomputed'.
+    """
+    n = len(points)
+    cells = np.floor(points / eps).astype(np.int64)
+    cells -= cells.min(axis=0) - 1 if n else 0
+    width = cells[:, 1].max() + 2 if n else 1
+    # Encodes each cell as one integer, adjacent cells differ by 1 (y) or width (x)
+    codes = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(codes, kind='stable')
+    cell_codes, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+
+    rows, cols, dists = [], [], []
+    for offset in [dx * width + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]:
+        # Finds the adjacent cell of each point, if it holds any points
+        cell_pos = np.searchsorted(cell_codes, codes + offset).clip(max=len(cell_codes) - 1)
+        found = cell_codes[cell_pos] == codes + offset
+        point_idx = np.flatnonzero(found)
+        cell_pos = cell_pos[found]
+        # Pairs each point with every point of its adjacent cell
+        pair_counts = counts[cell_pos]
+        row = np.repeat(point_idx, pair_counts)
+        pair_starts = np.cumsum(pair_counts) - pair_counts
+        col = order[np.repeat(starts[cell_pos] - pair_starts, pair_counts) + np.arange(pair_counts.sum())]
+        dist = np.hypot(*(points[row] - points[col]).T)
+        within = dist <= eps
+        rows.append(row[within])
+        cols.append(col[within])
+        dists.append(dist[within])
+    if not rows or not n:
+        return csr_matrix((n, n))
+    return csr_matrix((np.concatenate(dists), (np.concatenate(rows), np.concatenate(cols))), shape=(n, n))
+
+
 class UnmappedClusters(TestFunctionReturner):
     """
     Re-examines the test functions that are still unmapped at square root 6.
@@ -48,17 +111,46 @@ class UnmappedClusters(TestFunctionReturner):
     Inputs:
         sq_root_number (int) - this is defaulted to 6 for the analysis.
         train_df, ideal_df, test_df inherited from TestFunctionReturner.
+        eps, min_samples - DB-Scan parameters, defaulted to 500 and 2.
+        algorithm (str) - neighbour search of DB-Scan: 'auto', 'kd_tree', 'ball_tree', 'brute' or 'grid'
+        (grid bucketing, see grid_radius_graph).
+        n_jobs (int) - number of parallel jobs for the neighbour search, -1 uses all processors.
+        Cluster labels are calculated once and cached per unmapped set, eps and min_samples.
     Outputs:
         printed Euclidean distance table
         Bokeh graphs of original clusters and
 
     """
     # Initiates new constructor
-    def __init__(self, train_df, ideal_df, test_df, sq_root_number=6):
+    def __init__(self, train_df, ideal_df, test_df, sq_root_number=6, eps=500, min_samples=2, algorithm='auto',
+                 n_jobs=None):
         # Calls parent's (TrainFunctionReturner) constructor
         super().__init__(train_df, ideal_df, test_df, sq_root_number)
         # Assigns the square root attribute to 6
         self.sq_root_number = sq_root_number
+        # Assigns the DB-Scan parameters
+        self.eps = eps
+        self.min_samples = min_samples
+        self.algorithm = algorithm
+        self.n_jobs = n_jobs
+
+    @memoized('train_df', 'ideal_df', 'test_df', attributes=('eps', 'min_samples'))
+    def _cluster_labels(self):
+        """
+        Runs the DB-Scan algorithm on the unmapped functions set.
+        Input:
+            No explicit input but uses the unmapped functions set from test and the DB-Scan parameters.
+        Output:
+            labels (array) - cluster number per point of the unmapped functions set, -1 for noise.
+        """
+        points = self.unmapped_fns_set().reset_index()[['x', 'y_test_func']].to_numpy(dtype=np.float64)
+        if len(points) == 0:
+            return np.array([], dtype=np.int64)
+        if self.algorithm == 'grid':
+            dbscan = DBSCAN(eps=self.eps, min_samples=self.min_samples, metric='precomputed', n_jobs=self.n_jobs)
+            return dbscan.fit(grid_radius_graph(points, self.eps)).labels_
+        dbscan = DBSCAN(eps=self.eps, min_samples=self.min_samples, algorithm=self.algorithm, n_jobs=self.n_jobs)
+        return dbscan.fit(points).labels_
 
     def _clustered_df(self, filter_noise=False):
         """
@@ -73,8 +165,7 @@ class UnmappedClusters(TestFunctionReturner):
         _df = self.unmapped_fns_set().reset_index()
         # DBSCAN with epsilon is instantiated at a high number due to the distance between points
         # This is offset slightly by min samples = 2
-        dbscan = DBSCAN(eps=500, min_samples=2).fit(_df[['x', 'y_test_func']])
-        _df['dbscan_labels'] = dbscan.labels_
+        _df['dbscan_labels'] = self._cluster_labels()
 
         # Labels are int, need to recast to string
         _df['dbscan_labels'] = _df['dbscan_labels'].astype('str')
@@ -86,6 +177,20 @@ class UnmappedClusters(TestFunctionReturner):
         _df = _df.reset_index(drop=True)
         return _df
 
+    def incremental_clusters(self):
+        """
+        Starts an incremental clustering from the unmapped functions set, with the same DB-Scan parameters.
+        Unmapped points of later test batches are added with add_points, e.g.
+            clusters.add_points(UnmappedClusters(train_df, ideal_df, new_test_df).unmapped_fns_set())
+        Input:
+            No explicit input but uses the unmapped functions set from test.
+        Output:
+            clusters (IncrementalClusters) - clustering state, see incremental_clusters module.
+        """
+        clusters = IncrementalClusters(self.eps, self.min_samples)
+        clusters.add_points(self.unmapped_fns_set())
+        return clusters
+
     def _euclidean_dist(self, x, y):
         """
         Calculates the Euclidean distance within points in a function.
@@ -95,10 +200,12 @@ class UnmappedClusters(TestFunctionReturner):
         Outputs:
             Euclidean distance
         """
-        square_diff = square_number(calc_diff(x, y))
+        diff = calc_diff(x, y, dtype=np.float64)
+        square_diff = square_number(diff, out=diff)
         sqrt_sum = calc_square_root(sum_array(square_diff))
         return sqrt_sum
 
+    @instrumented
     def print_euclidean_dist(self):
         """
         Prints the Euclidean distance between the points within the same cluster.
@@ -126,12 +233,15 @@ class UnmappedClusters(TestFunctionReturner):
             y = '{0:.2f}'.format(y)
             print(f'{"Cluster "}{x}{":":^24s}{y:>6s}')
 
-    def original_cluster_display(self):
+    @instrumented
+    def original_cluster_display(self, dashboard=None):
         """
         Saves a Bokeh scatter plot of unmapped points, colour-coded to their respective
         cluster numbers.
         Input:
-            No explicit input but uses the clustered_df.
+            dashboard (Dashboard) - optional, if given the graph is added to it as a tab instead of
+            being saved as a separate file.
+            Otherwise uses the clustered_df.
         Output:
             original_unmapped_clusters.html
         """
@@ -155,8 +265,7 @@ class UnmappedClusters(TestFunctionReturner):
         p.x_range = Range1d(-50, 50)
         p.legend.title = "cluster number"
 
-        output_file(graphs_directory + 'original_unmapped_clusters.html')
-        save(p)
+        _save_or_add(p, 'original_unmapped_clusters', dashboard)
 
     def _cluster_centers(self):
         """
@@ -192,52 +301,37 @@ class UnmappedClusters(TestFunctionReturner):
             _df[this_column] = uni
         return _df
 
-    def polynomial_display(self):
+    @instrumented
+    def polynomial_display(self, dashboard=None, degrees=(3,)):
         """
         Saves a Bokeh graph of unmapped points' centroids, with best-fitting polynomial line.
         Normalised RMSE also calculated and displayed
         Input:
-            No explicit input but uses cluster_centers.
+            dashboard (Dashboard) - optional, if given the graph is added to it as a tab instead of
+            being saved as a separate file.
+            degrees (tuple) - polynomial degrees to fit, default is 3 only. The degree with the lowest
+            normalised RMSE is plotted.
+            Otherwise uses cluster_centers.
         Output:
             polynomial_line_unmapped_clusters.html
         """
         cluster_centers = self._cluster_centers()
-        x = cluster_centers['x_bar'].values.reshape(len(cluster_centers.index.values), 1)
-        y = cluster_centers['y_bar'].values
-
-        # Creates polynomial features
-        poly_feat = PolynomialFeatures(3)
-
-        # Creates a PolynomialFeatures object, then fit and transform the predictor feature
-        x_poly = poly_feat.fit_transform(x)
-
-        # Creates a LinearRegression object and fit it to the polynomial predictor features
-        poly_model = LinearRegression(fit_intercept=False)
-        poly_model = poly_model.fit(x_poly, y)
+        x = cluster_centers['x_bar'].to_numpy(dtype=np.float64)
+        y = cluster_centers['y_bar'].to_numpy(dtype=np.float64)
 
-        # Predicts the y co-ordinates based on the model
-        y_poly_pred = poly_model.predict(x_poly)
-
-        # Generates the normalised root mean squared error for the model
-        n_rmse = norm_root_mean_squared_error(y, y_poly_pred)
-        n_rmse = '{0:.2f}'.format(n_rmse)
+        # Fits each polynomial degree by least squares, keeping the best by normalised RMSE
+        fit = fit_polynomials([x], [y], degrees)[0]
+        n_rmse = '{0:.2f}'.format(fit['norm_rmse'])
 
         # Plots original x, y centroids
-        x_ = x.tolist()
-        x = [x for val in x_ for x in val]
-
-        _title = "Clustered unmapped points with 3rd degree polynomial line fitted." \
+        _title = "Clustered unmapped points with " + _ordinal(fit['degree']) + " degree polynomial line fitted." \
                  " Normalised RMSE: " + n_rmse
         p = figure(width=1000, height=750, title=_title)
         p.title.text_font_size = "14px"
-        p.circle(x, y, size=10, color=Spectral11[1])
+        p.circle(x.tolist(), y, size=10, color=Spectral11[1])
         p.xaxis.axis_label = 'x'
         p.yaxis.axis_label = 'y'
 
-        # Sorts the values of x before line plot
-        sort_axis = operator.itemgetter(0)
-        sorted_zip = sorted(zip(x, y_poly_pred), key=sort_axis)
-        x, y_poly_pred = zip(*sorted_zip)
-        p.line(x, y_poly_pred, line_width=2, color=Spectral11[3])
-        output_file(graphs_directory + 'polynomial_line_unmapped_clusters.html')
-        save(p)
+        # Plots the fitted line, evaluated on the sorted x values
+        p.line(tuple(fit['grid_x'].tolist()), tuple(fit['grid_y'].tolist()), line_width=2, color=Spectral11[3])
+        _save_or_add(p, 'polynomial_line_unmapped_clusters', dashboard)